@@ -0,0 +1,94 @@
+"""
+Change detection for the editor's autosave.
+
+Every keystroke restarts the autosave timer, so most ticks find nothing new.
+A tick first compares the QTextDocument revision counter with the one seen at
+the last save or check, which costs nothing; only a moved counter pays for
+toPlainText(). The text is then compared by a digest of its words, so edits
+that only add, drop or move whitespace are not saved on their own. They are
+carried along by the next real edit, or by a forced check when the editor
+closes.
+"""
+
+import hashlib
+from typing import List, Optional
+
+
+def digest(content: str) -> bytes:
+    return hashlib.blake2b(" ".join(content.split()).encode("utf-8"), digest_size=16).digest()
+
+
+class ChangeTracker:
+
+    def __init__(self):
+        # state of the editor when it last matched the memo in the store
+        self.revision = None
+        self.content = ""
+        self.digest = digest("")
+        self.tags = ()
+        self.loose = False
+
+        self.checks = 0
+        self.saves = 0
+        self.unchanged = 0
+        self.whitespace = 0
+        self.tagNoops = 0
+
+    def reset(self, document, content: str, tags: List[str]):
+        # the editor now shows `content` and `tags` as stored
+        self.revision = document.revision()
+        self.content = content
+        self.digest = digest(content)
+        self.tags = tuple(tags)
+        # whether the editor text differs from `content` in whitespace
+        self.loose = False
+
+    def check(self, document, tags: List[str], force: bool = False) -> Optional[str]:
+        # the stripped content to save, or None if the editor holds nothing new;
+        # `force` saves whitespace-only edits too
+        self.checks += 1
+        tags = tuple(tags)
+        revision = document.revision()
+        if revision == self.revision and not (force and self.loose):
+            if tags == self.tags:
+                self.unchanged += 1
+                return None
+            if not self.loose:
+                return self.content
+
+        content = document.toPlainText().strip()
+        if tags == self.tags:
+            if content == self.content:
+                self.unchanged += 1
+                self.revision = revision
+                self.loose = False
+                return None
+            if not force and digest(content) == self.digest:
+                # nothing to save until the words change again
+                self.whitespace += 1
+                self.revision = revision
+                self.loose = True
+                return None
+        return content
+
+    def tagsEdited(self, tags: List[str]) -> bool:
+        # false when a tag edit left the tags as they were saved
+        if tuple(tags) == self.tags:
+            self.tagNoops += 1
+            return False
+        return True
+
+    def saved(self, document, content: str, tags: List[str]):
+        self.saves += 1
+        self.reset(document, content, tags)
+
+    def stats(self):
+        skipped = self.unchanged + self.whitespace
+        return {
+            "checks": self.checks,
+            "saves": self.saves,
+            "unchanged": self.unchanged,
+            "whitespace": self.whitespace,
+            "tagNoops": self.tagNoops,
+            "skipRate": skipped / self.checks if self.checks else 0.0,
+        }
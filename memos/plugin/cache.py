@@ -0,0 +1,118 @@
+from collections import OrderedDict
+from typing import Optional
+
+from . import wal
+from .memo import MemoStore
+
+
+def doc_key(doc) -> Optional[str]:
+    # Document wrappers are recreated on every call, so identify the image itself
+    if doc is None:
+        return None
+    try:
+        root = doc.rootNode()
+        if root is not None:
+            return root.uniqueId().toString()
+    except Exception:
+        pass
+    return doc.fileName() or None
+
+
+class StoreCache:
+    MAX_STORES = 8
+    # estimated resident size of all stores, indexes included (see MemoStore.resident_bytes)
+    MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, maxStores=None, maxBytes=None):
+        self.maxStores = maxStores or self.MAX_STORES
+        self.maxBytes = maxBytes or self.MAX_BYTES
+        self.stores: "OrderedDict[str, MemoStore]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.loader = None
+
+    def __len__(self):
+        return len(self.stores)
+
+    def __contains__(self, key):
+        return key in self.stores
+
+    def get(self, doc, background=False) -> MemoStore:
+        key = doc_key(doc)
+        store = self.stores.get(key) if key else None
+        if store is not None:
+            self.hits += 1
+            self.stores.move_to_end(key)
+            store.doc = doc
+            return store
+
+        self.misses += 1
+        store = MemoStore()
+        if background:
+            if self.loader is None:
+                from .loader import StoreLoader
+                self.loader = StoreLoader()
+            store.doc = doc
+            store.builder = self.loader
+            self.loader.start(store)
+        else:
+            store.set_document(doc)
+        if key:
+            self.stores[key] = store
+            self._evict()
+        return store
+
+    def discard(self, key):
+        store = self.stores.pop(key, None)
+        if store is None:
+            return
+        if store.loadJob is not None:
+            store.loadJob.cancel()
+        store.flush()
+        # the journal already holds everything; don't touch a closed document later
+        store.compactor.cancel()
+        if store.wal is not None:
+            store.wal.sync()
+
+    def release(self, store):
+        # abandon a background load once no docker is waiting for it
+        if not store.loading or store.observed():
+            return
+        for key, s in list(self.stores.items()):
+            if s is store:
+                self.discard(key)
+
+    def retain(self, docs):
+        # drop stores whose document has been closed
+        keep = {doc_key(d) for d in docs}
+        for key in [k for k in self.stores if k not in keep]:
+            self.discard(key)
+
+    def saved(self, fileName):
+        for store in self.stores.values():
+            if store.doc is not None and store.doc.fileName() == fileName:
+                store.document_saved()
+
+    def closed(self, fileName):
+        path = wal.path_for(fileName)
+        kept = False
+        for store in self.stores.values():
+            if store.wal is not None and store.wal.path == path:
+                kept = store.document_closed() or kept
+        if not kept:
+            wal.remove(path)
+
+    def totalBytes(self):
+        return sum(s.resident_bytes() for s in self.stores.values())
+
+    def _evict(self):
+        # stores still shown by a docker stay, or a second copy would get loaded
+        idle = [k for k, s in self.stores.items() if not s.observed()]
+        for key in idle[:-1]:
+            if len(self.stores) <= self.maxStores and self.totalBytes() <= self.maxBytes:
+                break
+            self.discard(key)
+
+
+# shared by every docker so each document is parsed once per process
+stores = StoreCache()
@@ -0,0 +1,275 @@
+"""
+Annotation encoding for memo data.
+
+v1 is the original JSON document. v2 is a columnar binary layout:
+
+    b"KMM" | version:u8 | flags:u8 | body (zlib'd when FLAG_ZLIB)
+
+    body:   count:u32 tagCount:u32 tagBytes:u32 uidBytes:u32
+            tagLen:u32[tagCount]
+            created:i64[count]     modified:i64[count]   (µs since 1970-01-01, naive)
+            rankBytes:u32          rankLen:u32[count]    (only with FLAG_RANK)
+            uidLen:u32[count]      contentLen:u32[count]
+            memoTags:u32[count]    tagIdx:u32[sum(memoTags)]
+            tag text               uid text
+            rank text                                    (only with FLAG_RANK)
+            content text
+
+Each memo's rank (see ranks.py) is stored with FLAG_RANK; without it the memos
+are in display order.
+
+Lengths count characters, not bytes, so each text section is decoded with a
+single utf-8 decode and then sliced.
+"""
+
+import json
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
+
+MAGIC = b"KMM"
+VERSION = 2
+FLAG_ZLIB = 0x01
+FLAG_RANK = 0x04
+COMPRESS_THRESHOLD = 4096
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+_HEADER = struct.Struct("<3sBB")
+_COUNTS = struct.Struct("<IIII")
+
+
+def iso_to_us(iso: str) -> int:
+    dt = datetime.fromisoformat(iso)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return (dt - _EPOCH) // _US
+
+
+def us_to_iso(us: int) -> str:
+    return (_EPOCH + timedelta(microseconds=us)).isoformat()
+
+
+def _u32(values) -> array:
+    return array("I", values)
+
+
+def _pack(arr: array) -> bytes:
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack(typecode: str, buf, offset: int, count: int) -> Tuple[array, int]:
+    arr = array(typecode)
+    end = offset + count * arr.itemsize
+    arr.frombytes(buf[offset:end])
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr, end
+
+
+def encode(memos: List[Dict], compressThreshold: int = COMPRESS_THRESHOLD, ranks: List[str] = None) -> bytes:
+    tagIds: Dict[str, int] = {}
+    created, modified, uidLens, contentLens, memoTags, tagIdx = [], [], [], [], [], []
+    uids, contents = [], []
+
+    for m in memos:
+        uid = m["uid"]
+        content = m["content"]
+        uids.append(uid)
+        contents.append(content)
+        uidLens.append(len(uid))
+        contentLens.append(len(content))
+        created.append(iso_to_us(m["created"]))
+        modified.append(iso_to_us(m["modified"]))
+
+        tags = m.get("hashtags") or []
+        memoTags.append(len(tags))
+        for tag in tags:
+            idx = tagIds.get(tag)
+            if idx is None:
+                idx = tagIds[tag] = len(tagIds)
+            tagIdx.append(idx)
+
+    tagText = "".join(tagIds).encode("utf-8")
+    uidText = "".join(uids).encode("utf-8")
+    rankText = "".join(ranks).encode("utf-8") if ranks is not None else b""
+
+    parts = [
+        _COUNTS.pack(len(memos), len(tagIds), len(tagText), len(uidText)),
+        _pack(_u32(len(t) for t in tagIds)),
+        _pack(array("q", created)),
+        _pack(array("q", modified)),
+    ]
+    if ranks is not None:
+        parts.append(struct.pack("<I", len(rankText)))
+        parts.append(_pack(_u32(len(rank) for rank in ranks)))
+    parts += [
+        _pack(_u32(uidLens)),
+        _pack(_u32(contentLens)),
+        _pack(_u32(memoTags)),
+        _pack(_u32(tagIdx)),
+        tagText,
+        uidText,
+        rankText,
+        "".join(contents).encode("utf-8"),
+    ]
+    body = b"".join(parts)
+
+    flags = FLAG_RANK if ranks is not None else 0
+    if compressThreshold is not None and len(body) > compressThreshold:
+        packed = zlib.compress(body, 6)
+        if len(packed) < len(body):
+            body = packed
+            flags |= FLAG_ZLIB
+
+    return _HEADER.pack(MAGIC, VERSION, flags) + body
+
+
+def _split(text: str, lengths) -> List[str]:
+    ends = list(accumulate(lengths))
+    return [text[end - n:end] for n, end in zip(lengths, ends)]
+
+
+class Records:
+    """
+    Decoded memo data, materialized per field on demand.
+
+    Only uids are split up front; content, tags and timestamps are sliced or
+    formatted from the decoded columns the first time a memo asks for them.
+    """
+
+    def __init__(self, uids, contentText, contentEnds, tags, tagIdx, tagEnds, created, modified, order=None):
+        self.uids = uids
+        self.order = order
+        self._contentText = contentText
+        self._contentEnds = contentEnds
+        self._tags = tags
+        self._tagIdx = tagIdx
+        self._tagEnds = tagEnds
+        self._created = created
+        self._modified = modified
+
+    def __len__(self):
+        return len(self.uids)
+
+    def content(self, i: int) -> str:
+        start = self._contentEnds[i - 1] if i else 0
+        return self._contentText[start:self._contentEnds[i]]
+
+    def content_length(self, i: int) -> int:
+        start = self._contentEnds[i - 1] if i else 0
+        return self._contentEnds[i] - start
+
+    def hashtags(self, i: int) -> List[str]:
+        start = self._tagEnds[i - 1] if i else 0
+        tags = self._tags
+        return [tags[t] for t in self._tagIdx[start:self._tagEnds[i]]]
+
+    def created(self, i: int) -> str:
+        return us_to_iso(self._created[i])
+
+    def modified(self, i: int) -> str:
+        return us_to_iso(self._modified[i])
+
+    def created_us(self, i: int) -> int:
+        return self._created[i]
+
+    def modified_us(self, i: int) -> int:
+        return self._modified[i]
+
+
+class DictRecords:
+    # v1 JSON records behind the same interface as Records
+
+    def __init__(self, memos: List[Dict]):
+        self._memos = memos
+        self.uids = [m.get("uid") for m in memos]
+        self.order = None
+
+    def __len__(self):
+        return len(self._memos)
+
+    def content(self, i: int) -> str:
+        return self._memos[i]["content"]
+
+    def content_length(self, i: int) -> int:
+        return len(self._memos[i]["content"])
+
+    def hashtags(self, i: int) -> List[str]:
+        return list(self._memos[i].get("hashtags") or [])
+
+    def created(self, i: int) -> str:
+        return self._memos[i].get("created")
+
+    def modified(self, i: int) -> str:
+        return self._memos[i].get("modified")
+
+    def created_us(self, i: int) -> Optional[int]:
+        iso = self.created(i)
+        return iso_to_us(iso) if iso else None
+
+    def modified_us(self, i: int) -> Optional[int]:
+        iso = self.modified(i)
+        return iso_to_us(iso) if iso else None
+
+
+def _decode_v2(data: bytes) -> Records:
+    magic, version, flags = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"unsupported memo data version {version}")
+
+    body = memoryview(data)[_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        body = memoryview(zlib.decompress(body))
+
+    count, tagCount, tagBytes, uidBytes = _COUNTS.unpack_from(body)
+    pos = _COUNTS.size
+
+    tagLens, pos = _unpack("I", body, pos, tagCount)
+    created, pos = _unpack("q", body, pos, count)
+    modified, pos = _unpack("q", body, pos, count)
+    order = None
+    rankBytes = 0
+    if flags & FLAG_RANK:
+        rankBytes, = struct.unpack_from("<I", body, pos)
+        rankLens, pos = _unpack("I", body, pos + 4, count)
+    uidLens, pos = _unpack("I", body, pos, count)
+    contentLens, pos = _unpack("I", body, pos, count)
+    memoTags, pos = _unpack("I", body, pos, count)
+    tagIdx, pos = _unpack("I", body, pos, sum(memoTags))
+
+    tags = _split(str(body[pos:pos + tagBytes], "utf-8"), tagLens)
+    pos += tagBytes
+    uids = _split(str(body[pos:pos + uidBytes], "utf-8"), uidLens)
+    pos += uidBytes
+    if flags & FLAG_RANK:
+        order = _split(str(body[pos:pos + rankBytes], "utf-8"), rankLens)
+        pos += rankBytes
+    contentText = str(body[pos:], "utf-8")
+
+    return Records(
+        uids, contentText, array("Q", accumulate(contentLens)),
+        tags, tagIdx, array("Q", accumulate(memoTags)),
+        created, modified, order,
+    )
+
+
+def detect_version(data: bytes) -> int:
+    if data[:len(MAGIC)] == MAGIC and len(data) >= _HEADER.size:
+        return data[len(MAGIC)]
+    return 1
+
+
+def decode(data: bytes):
+    version = detect_version(data)
+    if version == 1:
+        parsed = json.loads(data.decode("utf-8"))
+        return 1, DictRecords(parsed.get("memos", []))
+    return version, _decode_v2(data)
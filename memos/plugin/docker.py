@@ -1,80 +1,19 @@
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QPushButton, QLabel,
-    QLineEdit, QTextEdit, QListWidget, QListWidgetItem,
+    QLineEdit, QTextEdit, QListView, QAbstractItemView,
     QComboBox, QSplitter, QMessageBox, QApplication, QMenu
 )
-from PyQt5.QtCore import Qt, QTimer, QRect
+from PyQt5.QtCore import Qt, QTimer, QRect, QEvent
 from krita import DockWidget, Krita
 
 from .memo import Memo, MemoStore
+from .cache import stores, doc_key
 from .i18n import i18n
 from .tag_edit import TagEdit
-
-
-class MemoListItem(QWidget):
-    def __init__(self, memo, parent=None):
-        super().__init__(parent)
-        self.memo = memo
-
-        layout = QGridLayout()
-        layout.setContentsMargins(4, 4, 4, 4)
-        layout.setHorizontalSpacing(12)
-        layout.setVerticalSpacing(0)
-
-        from datetime import datetime
-        from PyQt5.QtGui import QPalette
-        dt = datetime.fromisoformat(memo.modified)
-        dtStr = dt.strftime("%Y/%m/%d %H:%M:%S")
-
-        self.dateLabel = QLabel(dtStr)
-
-        palette = self.dateLabel.palette()
-        textColor = palette.color(QPalette.WindowText)
-        self.dateLabel.setStyleSheet(
-            f"font-size: 9px; color: rgba({textColor.red()}, {textColor.green()}, {textColor.blue()}, 0.4);"
-        )
-
-        layout.addWidget(self.dateLabel, 0, 0)
-
-        preview = memo.content[:50]
-        if len(memo.content) > 50:
-            preview += "..."
-
-        self.contentLabel = QLabel(preview)
-        layout.addWidget(self.contentLabel, 0, 1)
-
-        self.copyBtn = QPushButton()
-        self.copyBtn.setIcon(Krita.instance().icon("edit-copy"))
-        self.copyBtn.setFixedSize(24, 24)
-        self.copyBtn.setToolTip(i18n("Copy"))
-        layout.addWidget(self.copyBtn, 0, 2)
-
-        self.editBtn = QPushButton()
-        self.editBtn.setIcon(Krita.instance().icon("document-edit"))
-        self.editBtn.setFixedSize(24, 24)
-        self.editBtn.setToolTip(i18n("Edit"))
-        layout.addWidget(self.editBtn, 0, 3)
-
-        self.deleteBtn = QPushButton("✕")
-        self.deleteBtn.setFixedSize(24, 24)
-        self.deleteBtn.setToolTip(i18n("Delete"))
-        self.deleteBtn.setStyleSheet("""
-            QPushButton {
-                color: #ff7676;
-                font-size: 16px;
-                font-weight: bold;
-                border: none;
-                background: transparent;
-            }
-            QPushButton:hover {
-                color: #ff0000;
-            }
-        """)
-        layout.addWidget(self.deleteBtn, 0, 4)
-
-        layout.setColumnStretch(1, 1)
-
-        self.setLayout(layout)
+from .memo_list import MemoListModel, MemoDelegate
+from .search import SearchPipeline
+from .autosave import ChangeTracker
+from .query import parse_query
 
 
 class MemosDocker(DockWidget):
@@ -85,15 +24,24 @@ class MemosDocker(DockWidget):
         self.setWindowTitle(i18n("Memos"))
 
         self.store = MemoStore()
+        self.storeKey = None
         self.currentMemo = None
         self.hasUnsavedChanges = False
         self.lastSavedContent = ""
         self.lastSavedTags = []
-        self.deletedMemos = []
+        # decides whether an autosave tick has anything to write
+        self.changes = ChangeTracker()
+        self.filtersVersion = None
+        self.reordering = False
+
+        self.search = SearchPipeline(self)
+        self.search.resultsReady.connect(self.onSearchResults)
 
         self.autoSaveTimer = QTimer(self)
         self.autoSaveTimer.setSingleShot(True)
         self.autoSaveTimer.timeout.connect(self.onAutoSave)
+        # Krita actions that read the annotations, flushed to before they run
+        self.watchedActions = []
 
         self.setupUI()
         self.connectSignals()
@@ -114,22 +62,52 @@ class MemosDocker(DockWidget):
 
         self.searchInput = QLineEdit()
         self.searchInput.setPlaceholderText(i18n("Search..."))
+        self.searchInput.setToolTip(i18n('Words and "phrases" must all match. Also: tag:name -tag:name modified:>2026-01-01 created:<=2026-01-31'))
         topLayout.addWidget(self.searchInput)
 
+        self.rankBtn = QPushButton()
+        self.rankBtn.setCheckable(True)
+        self.rankBtn.setIcon(Krita.instance().icon("view-sort-descending"))
+        self.rankBtn.setToolTip(i18n("Sort results by relevance"))
+        topLayout.addWidget(self.rankBtn)
+
+        self.fuzzyBtn = QPushButton("≈")
+        self.fuzzyBtn.setCheckable(True)
+        self.fuzzyBtn.setToolTip(i18n("Tolerate typos"))
+        topLayout.addWidget(self.fuzzyBtn)
+
         topLayout.addWidget(QLabel(i18n("Tag:")))
         self.tagFilter = QComboBox()
         self.tagFilter.addItem(i18n("All"))
+        self.tagFilter.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.tagFilter.customContextMenuRequested.connect(self.showTagMenu)
         topLayout.addWidget(self.tagFilter)
 
+        self.sortCombo = QComboBox()
+        for label, mode in ((i18n("Manual"), "manual"), (i18n("Modified"), "modified"),
+                            (i18n("Created"), "created"), (i18n("A-Z"), "alpha")):
+            self.sortCombo.addItem(label, mode)
+        self.sortCombo.setToolTip(i18n("Sort order"))
+        topLayout.addWidget(self.sortCombo)
+
         layout.addLayout(topLayout)
 
         splitter = QSplitter(Qt.Vertical)
 
-        self.memoList = QListWidget()
+        self.memoModel = MemoListModel(self)
+        self.memoDelegate = MemoDelegate(self)
+
+        self.memoList = QListView()
+        self.memoList.setModel(self.memoModel)
+        self.memoList.setItemDelegate(self.memoDelegate)
+        self.memoList.setUniformItemSizes(True)
+        self.memoList.setMouseTracking(True)
         self.memoList.setSpacing(1)
+        self.memoList.setSelectionMode(QAbstractItemView.SingleSelection)
         self.memoList.setContextMenuPolicy(Qt.CustomContextMenu)
         self.memoList.customContextMenuRequested.connect(self.showContextMenu)
-        self.memoList.setDragDropMode(QListWidget.InternalMove)
+        self.memoList.setDragDropMode(QAbstractItemView.InternalMove)
+        self.memoList.setDefaultDropAction(Qt.MoveAction)
         splitter.addWidget(self.memoList)
 
         self.editorWidget = QWidget()
@@ -170,36 +148,90 @@ class MemosDocker(DockWidget):
 
     def connectSignals(self):
         self.searchInput.textChanged.connect(self.onSearchChanged)
+        self.rankBtn.toggled.connect(self.onRankToggled)
+        self.fuzzyBtn.toggled.connect(self.onFuzzyToggled)
         self.tagFilter.currentIndexChanged.connect(self.onFilterChanged)
-        self.memoList.itemClicked.connect(self.onMemoSelected)
-        self.memoList.itemDoubleClicked.connect(self.onMemoDoubleClicked)
-        self.memoList.model().rowsMoved.connect(self.onListReordered)
+        self.sortCombo.currentIndexChanged.connect(self.onFilterChanged)
+        self.memoList.clicked.connect(self.onMemoSelected)
+        self.memoList.doubleClicked.connect(self.onMemoDoubleClicked)
+        self.memoModel.rowsMoved.connect(self.onListReordered)
+        self.memoDelegate.copyClicked.connect(lambda uid: self.onMemoAction(uid, self.onCopyMemo))
+        self.memoDelegate.editClicked.connect(lambda uid: self.onMemoAction(uid, self.onEditMemo))
+        self.memoDelegate.deleteClicked.connect(lambda uid: self.onMemoAction(uid, self.onDeleteMemo))
         self.newBtn.clicked.connect(self.onNew)
         # self.copyBtn.clicked.connect(self.onCopy)
         self.closeBtn.clicked.connect(self.onClose)
 
         self.contentEdit.textChanged.connect(self.onContentChanged)
-        self.tagsEdit.tagsChanged.connect(self.onContentChanged)
+        self.tagsEdit.tagsChanged.connect(self.onTagsChanged)
 
     def connectKritaSignals(self):
         from .log import lg
         app = Krita.instance()
         app.notifier().setActive(True)
         app.notifier().windowCreated.connect(self.onDocumentChanged)
+        app.notifier().windowCreated.connect(self.watchSaveActions)
         app.notifier().viewCreated.connect(self.onDocumentChanged)
         app.notifier().viewClosed.connect(self.onDocumentChanged)
+        app.notifier().applicationClosing.connect(self.onApplicationClosing)
+        app.notifier().imageSaved.connect(self.onImageSaved)
+        app.notifier().imageClosed.connect(self.onImageClosed)
 
         lg.log("Checking for active document on init...")
         self.onDocumentChanged()
+        self.watchSaveActions()
+
+    # a save or export copies the annotations as it starts and a close drops
+    # what is not in them, so the open memo and the write-behind queue are
+    # flushed first: a shortcut reaches its action as an event before
+    # triggering it, and a menu or toolbar click always follows a hover
+    SAVE_ACTIONS = (
+        "file_save",
+        "file_save_as",
+        "save_incremental_version",
+        "save_incremental_backup",
+        "file_export_file",
+        "file_export_advanced",
+        "file_close",
+        "file_close_all",
+    )
+
+    def watchSaveActions(self):
+        app = Krita.instance()
+        for name in self.SAVE_ACTIONS:
+            action = app.action(name)
+            if action is None or action in self.watchedActions:
+                continue
+            self.watchedActions.append(action)
+            action.installEventFilter(self)
+            action.hovered.connect(self.flushEditor)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Shortcut and obj in self.watchedActions:
+            self.flushEditor()
+        return super().eventFilter(obj, event)
+
+    def flushEditor(self):
+        # puts the open memo and any queued write into the annotations now
+        self.autoSaveTimer.stop()
+        if self.hasUnsavedChanges or self.changes.loose:
+            self.saveMemo(force=True)
+        self.store.flush()
 
     def onDocumentChanged(self):
         from .log import lg
         try:
             app = Krita.instance()
             doc = app.activeDocument()
+            stores.retain(app.documents())
             if doc:
+                key = doc_key(doc)
+                if key is not None and key == self.storeKey:
+                    return
+
                 lg.log(f"Document changed: {doc.fileName()}")
-                self.store.set_document(doc)
+                self.closeEditor()
+                self.setStore(stores.get(doc, background=True), key)
                 self.currentMemo = None
                 self.editorWidget.hide()
                 self.memoList.clearSelection()
@@ -207,26 +239,114 @@ class MemosDocker(DockWidget):
                 self.refreshList()
             else:
                 lg.log("No active document - clearing UI")
-                self.store.doc = None
-                self.store.memos = []
+                self.closeEditor()
+                self.setStore(MemoStore(), None)
                 self.currentMemo = None
                 self.editorWidget.hide()
                 self.memoList.clearSelection()
-                self.memoList.clear()
+                self.memoModel.setMemos([])
                 self.setWindowTitle(i18n("Memos"))
         except Exception as e:
             lg.error(f"onDocumentChanged error: {e}")
             import traceback
             traceback.print_exc()
 
+    def setStore(self, store, key):
+        old = self.store
+        old.flush()
+        old.unsubscribe(self.onStoreChanged)
+        stores.release(old)
+
+        self.store = store
+        self.storeKey = key
+        self.filtersVersion = None
+        self.search.setStore(store)
+        self.store.subscribe(self.onStoreChanged)
+        self.showLoading(store.loading)
+
+    def showLoading(self, loading):
+        self.newBtn.setEnabled(not loading)
+        self.searchInput.setEnabled(not loading)
+        self.rankBtn.setEnabled(not loading)
+        self.fuzzyBtn.setEnabled(not loading)
+        self.tagFilter.setEnabled(not loading)
+        self.sortCombo.setEnabled(not loading)
+        self.memoList.setEnabled(not loading)
+        if loading:
+            self.memoModel.setMemos([])
+            self.setWindowTitle(f"{i18n('Memos')} ({i18n('Loading...')})")
+
+    def onStoreChanged(self, event, uid):
+        if event == "reset":
+            self.showLoading(False)
+
+        # the store may be shared with dockers in other windows
+        if self.currentMemo and (event == "reset" or self.currentMemo.uid == uid):
+            if self.currentMemo.uid not in self.store:
+                self.autoSaveTimer.stop()
+                self.hasUnsavedChanges = False
+                self.currentMemo = None
+                self.editorWidget.hide()
+            elif event in ("update", "reset"):
+                self.syncEditor()
+
+        # a drag in this list already shows the new order
+        if event == "reorder" and self.reordering:
+            return
+
+        self.refreshFilters()
+        # ranked and fuzzy lists can't place a single row with memo.matches
+        incremental = self.search.mode(self.searchInput.text()) is None
+        if event in ("add", "update") and incremental:
+            self.refreshRow(uid)
+        elif event == "delete":
+            self.memoModel.removeMemo(uid)
+        else:
+            self.refreshList()
+        self.refreshTitle()
+
+    def syncEditor(self):
+        memo = self.currentMemo
+        if self.hasUnsavedChanges:
+            return
+        if memo.content == self.lastSavedContent and memo.hashtags == self.lastSavedTags:
+            return
+
+        self.contentEdit.blockSignals(True)
+        self.tagsEdit.blockSignals(True)
+        self.contentEdit.setText(memo.content)
+        self.tagsEdit.setTags(memo.hashtags)
+        self.contentEdit.blockSignals(False)
+        self.tagsEdit.blockSignals(False)
+        self.lastSavedContent = memo.content
+        self.lastSavedTags = memo.hashtags[:]
+        self.changes.reset(self.contentEdit.document(), memo.content, memo.hashtags)
+
+    def onImageSaved(self, fileName):
+        stores.saved(fileName)
+
+    def onImageClosed(self, fileName):
+        stores.closed(fileName)
+
+    def onApplicationClosing(self):
+        self.flushEditor()
+
     def refreshFilters(self):
+        if self.store.loading:
+            return
+        version = self.store.hashtags_version
+        if version == self.filtersVersion:
+            return
+        self.filtersVersion = version
+
+        tags = self.store.get_hashtags()
         self.tagFilter.blockSignals(True)
 
         curTag = self.tagFilter.currentText()
 
         self.tagFilter.clear()
         self.tagFilter.addItem(i18n("All"))
-        for tag in self.store.get_hashtags():
+        for tag in tags:
             self.tagFilter.addItem(tag)
 
         idx = self.tagFilter.findText(curTag)
@@ -234,83 +354,177 @@ class MemosDocker(DockWidget):
             self.tagFilter.setCurrentIndex(idx)
 
         self.tagFilter.blockSignals(False)
-        self.tagsEdit.setAvailableTags(self.store.get_hashtags())
+        self.tagsEdit.setAvailableTags(tags)
 
-    def refreshList(self):
-        self.memoList.clear()
+    def currentFilter(self):
+        tag = self.tagFilter.currentText()
+        if tag == i18n("All"):
+            tag = None
+        return self.searchInput.text(), tag
 
-        memos = self.store.memos[:]
+    def sortMode(self):
+        return self.sortCombo.currentData() or "manual"
 
-        query = self.searchInput.text()
-        if query:
-            memos = [m for m in memos if m.matches(query)]
+    def isMemoVisible(self, memo):
+        query, tag = self.currentFilter()
+        return parse_query(query).matches(memo) and (not tag or tag in memo.hashtags)
 
-        tag = self.tagFilter.currentText()
-        if tag and tag != i18n("All"):
-            memos = [m for m in memos if tag in m.hashtags]
-
-        for memo in reversed(memos):
-            item = QListWidgetItem()
-            item.setData(Qt.UserRole, memo.uid)
-            self.memoList.addItem(item)
-
-            widget = MemoListItem(memo)
-            widget.deleteBtn.clicked.connect(lambda checked, m=memo: self.closeEditorAndExecute(lambda: self.onDeleteMemo(m)))
-            widget.copyBtn.clicked.connect(lambda checked, m=memo: self.closeEditorAndExecute(lambda: self.onCopyMemo(m)))
-            widget.editBtn.clicked.connect(lambda checked, m=memo: self.closeEditorAndExecute(lambda: self.onEditMemo(m)))
-            item.setSizeHint(widget.sizeHint())
-            self.memoList.setItemWidget(item, widget)
-
-        totalCount = len(self.store.memos)
+    def selectedUid(self):
+        idx = self.memoList.currentIndex()
+        if idx.isValid() and self.memoList.selectionModel().isSelected(idx):
+            return idx.data(MemoListModel.UidRole)
+        return None
+
+    def refreshList(self):
+        if self.store.loading:
+            return
+        query, tag = self.currentFilter()
+        self.search.runNow(query, tag)
+
+    def onSearchResults(self, memos, query, tag):
+        if (query, tag) != self.currentFilter():
+            return
+
+        selected = self.selectedUid()
+        scroll = self.memoList.verticalScrollBar().value()
+
+        # ranked results come best first; only the manual order can be dragged into
+        ranked = self.search.isRanked(query)
+        if not ranked:
+            memos = self.store.sorted(memos, self.sortMode())
+        draggable = not ranked and self.sortMode() == "manual"
+        self.memoList.setDragDropMode(QAbstractItemView.InternalMove if draggable else QAbstractItemView.NoDragDrop)
+        self.memoModel.sync(memos)
+
+        row = self.memoModel.rowOf(selected) if selected else -1
+        if row >= 0:
+            self.memoList.setCurrentIndex(self.memoModel.index(row))
+        self.memoList.verticalScrollBar().setValue(scroll)
+        self.refreshTitle()
+
+    def refreshTitle(self):
+        totalCount = len(self.store)
         self.setWindowTitle(f"{i18n('Memos')} ({totalCount})")
 
+    def rowForNewMemo(self, memo):
+        # rows are kept in the sort mode's display order
+        keyOf, reverse = self.store.sort_key(self.sortMode())
+        key = keyOf(memo)
+        memos = self.memoModel.memos
+        lo, hi = 0, len(memos)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            other = keyOf(memos[mid])
+            if (other > key) if reverse else (other < key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def isRowInPlace(self, row):
+        keyOf, reverse = self.store.sort_key(self.sortMode())
+        memos = self.memoModel.memos
+        keys = [keyOf(m) for m in memos[max(0, row - 1):row + 2]]
+        return keys == sorted(keys, reverse=reverse)
+
+    def refreshRow(self, uid):
+        memo = self.store.get(uid)
+        if memo is None:
+            return
+
+        visible = self.isMemoVisible(memo)
+        row = self.memoModel.rowOf(uid)
+        if row < 0:
+            if visible:
+                self.memoModel.insertMemo(self.rowForNewMemo(memo), memo)
+        elif not visible:
+            self.memoModel.removeMemo(uid)
+        elif not self.isRowInPlace(row):
+            # e.g. an edit moves a memo to the top when sorted by modified
+            selected = self.selectedUid() == uid
+            self.memoModel.removeMemo(uid)
+            row = self.rowForNewMemo(memo)
+            self.memoModel.insertMemo(row, memo)
+            if selected:
+                self.memoList.setCurrentIndex(self.memoModel.index(row))
+        else:
+            self.memoModel.refreshRow(row)
+
     def onSearchChanged(self):
-        self.refreshList()
+        query, tag = self.currentFilter()
+        self.search.request(query, tag)
 
     def onFilterChanged(self):
         self.refreshList()
 
+    def onRankToggled(self, checked):
+        self.search.setRanked(checked)
+        self.refreshList()
+
+    def onFuzzyToggled(self, checked):
+        self.search.setFuzzy(checked)
+        self.refreshList()
+
     def hasValidDocument(self):
+        if self.store.loading:
+            return False
         return (self.canvas() is not None) and (self.canvas().view() is not None)
 
-    def closeEditorAndExecute(self, callback):
+    def closeEditor(self):
         if self.editorWidget.isVisible():
             self.autoSaveTimer.stop()
-            if self.hasUnsavedChanges:
-                self.saveMemo()
+            if self.hasUnsavedChanges or self.changes.loose:
+                self.saveMemo(force=True)
+            self.store.flush()
             self.editorWidget.hide()
             self.currentMemo = None
             self.memoList.clearSelection()
+
+    def closeEditorAndExecute(self, callback):
+        self.closeEditor()
         if self.hasValidDocument():
             callback()
 
-    def onMemoSelected(self, item):
+    def onMemoAction(self, uid, action):
+        memo = self.store.get(uid)
+        if memo:
+            self.closeEditorAndExecute(lambda: action(memo))
+
+    def onMemoSelected(self, index):
         if self.editorWidget.isVisible():
             self.closeEditorAndExecute(lambda: None)
 
-    def onMemoDoubleClicked(self, item):
-        uid = item.data(Qt.UserRole)
+    def onMemoDoubleClicked(self, index):
+        uid = index.data(MemoListModel.UidRole)
         memo = self.store.get(uid)
         if memo:
             self.onEditMemo(memo)
 
-    def onListReordered(self):
+    def onListReordered(self, parent, start, end, dest, row):
         from .log import lg
         if not self.hasValidDocument():
             lg.log("List reorder skipped: no document")
             return
+        if self.sortMode() != "manual":
+            return
 
-        lg.log("List reordered")
-        new_order = []
-        for i in range(self.memoList.count()):
-            item = self.memoList.item(i)
-            uid = item.data(Qt.UserRole)
-            memo = self.store.get(uid)
-            if memo:
-                new_order.append(memo)
-
-        self.store.memos = new_order
-        self.store.save()
+        count = end - start + 1
+        first = row - count if row > start else row
+        lg.log(f"List reordered: {count} row(s) to {first}")
+
+        # the list shows the newest memo first, so the row above a memo is
+        # above it in store order too; rank the moved rows bottom-up, each
+        # between the row under it and the unmoved row above the block
+        model = self.memoModel
+        top = model.memoAt(first - 1)
+        above = top.uid if top else None
+        self.reordering = True
+        try:
+            for r in range(first + count - 1, first - 1, -1):
+                under = model.memoAt(r + 1)
+                self.store.move(model.memoAt(r).uid, under.uid if under else None, above)
+        finally:
+            self.reordering = False
 
     def onEditMemo(self, memo):
         self.autoSaveTimer.stop()
@@ -319,24 +533,29 @@ class MemosDocker(DockWidget):
         self.tagsEdit.setTags(memo.hashtags)
         self.lastSavedContent = memo.content
         self.lastSavedTags = memo.hashtags[:]
+        self.changes.reset(self.contentEdit.document(), memo.content, memo.hashtags)
         self.hasUnsavedChanges = False
         self.editorWidget.show()
 
     def onContentChanged(self):
-        from .log import lg
-        lg.log("onContentChanged called")
+        # runs on every keystroke: no logging, and the text is only read for a new memo
         self.hasUnsavedChanges = True
         self.autoSaveTimer.stop()
 
-        if self.currentMemo is None:
+        if self.currentMemo is None and not self.contentEdit.document().isEmpty():
             content = self.contentEdit.toPlainText().strip()
             if content:
+                from .log import lg
                 lg.log("New memo: creating immediately")
                 self.createNewMemo()
-            else:
-                self.autoSaveTimer.start(300)
-        else:
-            self.autoSaveTimer.start(300)
+                return
+        self.autoSaveTimer.start(300)
+
+    def onTagsChanged(self):
+        # a tag removed and added back leaves nothing to save
+        if self.currentMemo and not self.hasUnsavedChanges and not self.changes.tagsEdited(self.tagsEdit.getTags()):
+            return
+        self.onContentChanged()
 
     def createNewMemo(self):
         from .log import lg
@@ -353,25 +572,23 @@ class MemosDocker(DockWidget):
 
             lg.log("Creating new memo")
             memo = Memo(content, hashtags)
-            self.store.add(memo)
             self.currentMemo = memo
-
             self.lastSavedContent = content
             self.lastSavedTags = hashtags[:]
+            self.store.add(memo)
+            self.changes.saved(self.contentEdit.document(), content, hashtags)
             self.hasUnsavedChanges = False
-
-            self.refreshFilters()
-            self.refreshList()
             lg.log("New memo created")
         except Exception as e:
             lg.error(f"Create memo failed: {e}")
             import traceback
             traceback.print_exc()
 
-    def saveMemo(self):
+    def saveMemo(self, force=False):
+        # `force` also writes whitespace-only edits, which autosave ticks skip
         from .log import lg
         try:
-            if not self.hasUnsavedChanges:
+            if not self.hasUnsavedChanges and not (force and self.changes.loose):
                 return
 
             if not self.currentMemo:
@@ -381,26 +598,19 @@ class MemosDocker(DockWidget):
                 lg.log("Save skipped: no document")
                 return
 
-            content = self.contentEdit.toPlainText().strip()
             hashtags = self.tagsEdit.getTags()
-
-            if content == self.lastSavedContent and hashtags == self.lastSavedTags:
-                self.hasUnsavedChanges = False
-                return
+            content = self.changes.check(self.contentEdit.document(), hashtags, force)
 
             if not content:
                 self.hasUnsavedChanges = False
                 return
 
             lg.log(f"Save: Updating memo {self.currentMemo.uid}")
-            self.store.update(self.currentMemo.uid, content, hashtags)
-
             self.lastSavedContent = content
             self.lastSavedTags = hashtags[:]
+            self.changes.saved(self.contentEdit.document(), content, hashtags)
             self.hasUnsavedChanges = False
-
-            self.refreshFilters()
-            self.refreshList()
+            self.store.update(self.currentMemo.uid, content, hashtags)
             lg.log("Save completed")
         except Exception as e:
             lg.error(f"Save failed: {e}")
@@ -419,12 +629,15 @@ class MemosDocker(DockWidget):
             return
 
         self.autoSaveTimer.stop()
+        if self.hasUnsavedChanges or self.changes.loose:
+            self.saveMemo(force=True)
         self.currentMemo = None
         self.hasUnsavedChanges = False
         self.lastSavedContent = ""
         self.lastSavedTags = []
         self.contentEdit.clear()
         self.tagsEdit.clear()
+        self.changes.reset(self.contentEdit.document(), "", [])
         self.editorWidget.show()
         self.contentEdit.setFocus()
         lg.log("onNew completed")
@@ -450,10 +663,11 @@ class MemosDocker(DockWidget):
 
     def onClose(self):
         from .log import lg
-        lg.log("onClose called")
+        lg.log(f"onClose called, autosave: {self.changes.stats()}")
         self.autoSaveTimer.stop()
-        if self.hasUnsavedChanges:
-            self.saveMemo()
+        if self.hasUnsavedChanges or self.changes.loose:
+            self.saveMemo(force=True)
+        self.store.flush()
         self.editorWidget.hide()
         self.currentMemo = None
         self.memoList.clearSelection()
@@ -466,13 +680,7 @@ class MemosDocker(DockWidget):
             QMessageBox.Yes | QMessageBox.No
         )
         if reply == QMessageBox.Yes:
-            self.deletedMemos.append(memo)
             self.store.delete(memo.uid)
-            if self.currentMemo and self.currentMemo.uid == memo.uid:
-                self.currentMemo = None
-                self.editorWidget.hide()
-            self.refreshFilters()
-            self.refreshList()
 
     def showContextMenu(self, pos):
         from .log import lg
@@ -483,47 +691,93 @@ class MemosDocker(DockWidget):
 
             menu = QMenu(self)
 
-            undoAction = menu.addAction(Krita.instance().icon("edit-undo"), i18n("Undo Delete"))
-            undoAction.setEnabled(len(self.deletedMemos) > 0)
+            undoAction = menu.addAction(Krita.instance().icon("edit-undo"), i18n("Undo"))
+            undoAction.setEnabled(self.store.can_undo() or self.hasUnsavedChanges)
+            redoAction = menu.addAction(Krita.instance().icon("edit-redo"), i18n("Redo"))
+            redoAction.setEnabled(self.store.can_redo())
 
-            item = self.memoList.itemAt(pos)
+            index = self.memoList.indexAt(pos)
             deleteAction = None
-            if item:
+            historyAction = None
+            if index.isValid():
                 deleteAction = menu.addAction(Krita.instance().icon("edit-delete"), i18n("Delete"))
+                historyAction = menu.addAction(Krita.instance().icon("view-history"), i18n("History..."))
+                historyAction.setEnabled(self.store.keepRevisions)
 
             action = menu.exec_(self.memoList.mapToGlobal(pos))
 
             if action == undoAction:
-                self.onUndoDelete()
-            elif action == deleteAction and item:
-                uid = item.data(Qt.UserRole)
-                memo = self.store.get(uid)
-                if memo:
-                    self.deletedMemos.append(memo)
+                self.onUndo()
+            elif action == redoAction:
+                self.onRedo()
+            elif action == deleteAction and index.isValid():
+                uid = index.data(MemoListModel.UidRole)
+                if uid in self.store:
                     self.store.delete(uid)
-                    if self.currentMemo and self.currentMemo.uid == uid:
-                        self.currentMemo = None
-                        self.editorWidget.hide()
-                    self.refreshFilters()
-                    self.refreshList()
+            elif action == historyAction and index.isValid():
+                uid = index.data(MemoListModel.UidRole)
+                self.onMemoAction(uid, self.onShowHistory)
 
         except Exception as e:
             lg.error(f"Context menu error: {e}")
             import traceback
             traceback.print_exc()
 
-    def onUndoDelete(self):
+    def showTagMenu(self, pos):
+        tag = self.tagFilter.currentText()
+        if not self.hasValidDocument() or not tag or tag == i18n("All"):
+            return
+
+        menu = QMenu(self)
+        renameAction = menu.addAction(i18n("Rename Tag..."))
+        action = menu.exec_(self.tagFilter.mapToGlobal(pos))
+        if action == renameAction:
+            self.onRenameTag(tag)
+
+    def onRenameTag(self, tag):
+        from PyQt5.QtWidgets import QInputDialog
+        from .log import lg
+        newTag, ok = QInputDialog.getText(self, i18n("Rename Tag"), i18n("New name (an existing tag merges):"), text=tag)
+        newTag = newTag.lstrip("#").strip() if ok else ""
+        if not newTag or newTag == tag:
+            return
+
+        self.closeEditor()
+        count = self.store.rename_tag(tag, newTag)
+        lg.log(f"Renamed tag '{tag}' to '{newTag}' on {count} memos")
+        idx = self.tagFilter.findText(newTag)
+        if idx >= 0:
+            self.tagFilter.setCurrentIndex(idx)
+
+    def onShowHistory(self, memo):
+        from .revision_dialog import RevisionDialog
+        dialog = RevisionDialog(self.store, memo.uid, self)
+        dialog.exec_()
+
+    def onUndo(self):
         from .log import lg
         if not self.hasValidDocument():
-            lg.log("Undo delete skipped: no document")
+            lg.log("Undo skipped: no document")
             return
 
-        if self.deletedMemos:
-            memo = self.deletedMemos.pop()
-            self.store.memos.append(memo)
-            self.store.save()
-            self.refreshFilters()
-            self.refreshList()
+        # an edit still waiting for autosave is the newest change
+        self.autoSaveTimer.stop()
+        if self.hasUnsavedChanges or self.changes.loose:
+            self.saveMemo(force=True)
+        if self.store.undo():
+            lg.log(f"Undo: {self.store.undoStack.stats()}")
+
+    def onRedo(self):
+        from .log import lg
+        if not self.hasValidDocument():
+            lg.log("Redo skipped: no document")
+            return
+
+        self.autoSaveTimer.stop()
+        if self.hasUnsavedChanges or self.changes.loose:
+            self.saveMemo(force=True)
+        if self.store.redo():
+            lg.log(f"Redo: {self.store.undoStack.stats()}")
 
     def canvasChanged(self, canvas):
         self.onDocumentChanged()
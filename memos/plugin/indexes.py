@@ -0,0 +1,503 @@
+import bisect
+import heapq
+import math
+import re
+import sys
+import time
+from array import array
+from collections import Counter
+from operator import itemgetter
+from typing import Dict, List, Optional, Set, Tuple
+
+# kana, CJK ideographs and hangul: written without spaces, so runs of them are
+# split into overlapping bigrams instead of being taken as one word
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN = re.compile(f"[{_CJK}]+|[^\\W_{_CJK}]+")
+_CJK_CHAR = re.compile(f"[{_CJK}]")
+
+
+def tokenize(text: str, query: bool = False) -> List[str]:
+    # documents also index CJK unigrams so a one-character query still matches
+    tokens = []
+    for run in _TOKEN.findall(text.lower()):
+        if len(run) == 1 or not _CJK_CHAR.match(run):
+            tokens.append(run)
+            continue
+        if not query:
+            tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    # edit distance counting a swap of adjacent characters as one edit
+    # (optimal string alignment), or limit + 1 as soon as it is known to
+    # exceed limit
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        best = i
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if before is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb and before[j - 2] + 1 < d:
+                d = before[j - 2] + 1
+            cur.append(d)
+            if d < best:
+                best = d
+        if best > limit:
+            return limit + 1
+        before, prev = prev, cur
+    return prev[-1] if prev[-1] <= limit else limit + 1
+
+
+class TrigramIndex:
+    # haystack parts are joined with a character a typed query can't contain,
+    # so a substring hit never spans content and tags
+    SEP = "\x00"
+
+    # postings are compact arrays of small int doc ids rather than sets of uid
+    # strings; a memo's trigrams are recomputed from its text when it changes,
+    # so the only per-memo state is the lowercase text itself
+    def __init__(self):
+        self._postings: Dict[str, array] = {}
+        self._texts: Dict[str, str] = {}
+        self._ids: Dict[str, int] = {}
+        self._uids: List[Optional[str]] = []
+        self._freeIds: List[int] = []
+
+    @staticmethod
+    def _trigrams(text: str) -> Set[str]:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def clear(self):
+        self.__init__()
+
+    @classmethod
+    def build(cls, items) -> 'TrigramIndex':
+        # bulk load from (uid, content, hashtags) rows, skipping add()'s diffing
+        index = cls()
+        postings = index._postings
+        texts = index._texts
+        ids = index._ids
+        uids = index._uids
+        sep = cls.SEP
+        intern = sys.intern
+        for uid, content, hashtags in items:
+            text = sep.join([content.lower()] + [t.lower() for t in hashtags])
+            if uid in ids:
+                index.add(uid, content, hashtags)
+                continue
+            docId = ids[uid] = len(uids)
+            uids.append(uid)
+            texts[uid] = text
+            for g in {text[i:i + 3] for i in range(len(text) - 2)}:
+                posting = postings.get(g)
+                if posting is None:
+                    postings[intern(g)] = array("I", (docId,))
+                else:
+                    posting.append(docId)
+        return index
+
+    def _id(self, uid: str) -> int:
+        docId = self._ids.get(uid)
+        if docId is None:
+            if self._freeIds:
+                docId = self._freeIds.pop()
+                self._uids[docId] = uid
+            else:
+                docId = len(self._uids)
+                self._uids.append(uid)
+            self._ids[uid] = docId
+        return docId
+
+    def add(self, uid: str, content: str, hashtags: List[str]):
+        text = self.SEP.join([content.lower()] + [t.lower() for t in hashtags])
+        old = self._texts.get(uid)
+        if old == text:
+            return
+
+        docId = self._id(uid)
+        grams = self._trigrams(text)
+        if old is not None:
+            oldGrams = self._trigrams(old)
+            self._unpost(docId, oldGrams - grams)
+            grams -= oldGrams
+        postings = self._postings
+        for g in grams:
+            ids = postings.get(g)
+            if ids is None:
+                # one shared key object per distinct trigram
+                postings[sys.intern(g)] = array("I", (docId,))
+            else:
+                ids.append(docId)
+        self._texts[uid] = text
+
+    def _unpost(self, docId: int, grams):
+        for g in grams:
+            ids = self._postings.get(g)
+            if ids is None:
+                continue
+            try:
+                ids.remove(docId)
+            except ValueError:
+                continue
+            if not ids:
+                del self._postings[g]
+
+    def remove(self, uid: str):
+        text = self._texts.pop(uid, None)
+        docId = self._ids.pop(uid, None)
+        if docId is None:
+            return
+        if text is not None:
+            self._unpost(docId, self._trigrams(text))
+        self._uids[docId] = None
+        self._freeIds.append(docId)
+
+    def estimate(self, query: str) -> int:
+        # upper bound on search(query)'s size, from its rarest trigram
+        ql = query.lower()
+        if len(ql) < 3:
+            return len(self._texts)
+        return min(len(self._postings.get(g, ())) for g in self._trigrams(ql))
+
+    def search(self, query: str) -> Set[str]:
+        ql = query.lower()
+        if len(ql) < 3:
+            # too short for trigrams, scan the cached lowercase text instead
+            return {uid for uid, text in self._texts.items() if ql in text}
+
+        postings = []
+        for g in self._trigrams(ql):
+            ids = self._postings.get(g)
+            if not ids:
+                return set()
+            postings.append(ids)
+
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates = candidates.intersection(ids)
+            if not candidates:
+                return candidates
+
+        uids = self._uids
+        texts = self._texts
+        return {uids[i] for i in candidates if ql in texts[uids[i]]}
+
+
+class TagIndex:
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._tags: Dict[str, tuple] = {}
+        self._sorted: List[str] = []
+        # bumped whenever the set of known tags changes
+        self.version = 0
+
+    def clear(self):
+        self._postings = {}
+        self._tags = {}
+        self._sorted = []
+        self.version += 1
+
+    @classmethod
+    def build(cls, items) -> 'TagIndex':
+        # bulk load from (uid, hashtags) pairs, skipping the per-memo diffing of add()
+        index = cls()
+        postings = index._postings
+        memoTags = index._tags
+        for uid, hashtags in items:
+            if not hashtags:
+                continue
+            tags = tuple(dict.fromkeys(hashtags))
+            memoTags[uid] = tags
+            for tag in tags:
+                uids = postings.get(tag)
+                if uids is None:
+                    uids = postings[tag] = set()
+                uids.add(uid)
+        index._sorted = None
+        return index
+
+    def add(self, uid: str, hashtags: List[str]):
+        tags = tuple(dict.fromkeys(hashtags))
+        old = self._tags.get(uid, ())
+        if old == tags:
+            return
+
+        changed = False
+        for tag in old:
+            if tag in tags:
+                continue
+            uids = self._postings[tag]
+            uids.discard(uid)
+            if not uids:
+                del self._postings[tag]
+                changed = True
+        for tag in tags:
+            uids = self._postings.get(tag)
+            if uids is None:
+                uids = self._postings[tag] = set()
+                changed = True
+            uids.add(uid)
+
+        if tags:
+            self._tags[uid] = tags
+        else:
+            self._tags.pop(uid, None)
+
+        if changed:
+            self._sorted = None
+            self.version += 1
+
+    def remove(self, uid: str):
+        self.add(uid, [])
+
+    def uids(self, tag: str) -> Set[str]:
+        return self._postings.get(tag, set())
+
+    def count(self, tag: str) -> int:
+        return len(self._postings.get(tag, ()))
+
+    def counts(self) -> Dict[str, int]:
+        return {tag: len(uids) for tag, uids in self._postings.items()}
+
+    def tags(self) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self._postings)
+        return self._sorted
+
+
+class SortedIndex:
+    # (key, uid) pairs kept sorted with bisect: O(log n) range bounds, ordered walks
+    # without sorting, and an O(n) memmove per insert or removal
+
+    def __init__(self):
+        self._entries: List[tuple] = []
+        self._keys: Dict[str, object] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def build(cls, items) -> 'SortedIndex':
+        # bulk load from (uid, key) pairs
+        index = cls()
+        index._keys = dict(items)
+        index._entries = sorted((key, uid) for uid, key in index._keys.items())
+        return index
+
+    def add(self, uid: str, key):
+        if uid in self._keys and self._keys[uid] == key:
+            return
+        self.remove(uid)
+        bisect.insort(self._entries, (key, uid))
+        self._keys[uid] = key
+
+    def remove(self, uid: str):
+        if uid not in self._keys:
+            return
+        key = self._keys.pop(uid)
+        i = bisect.bisect_left(self._entries, (key, uid))
+        del self._entries[i]
+
+    def _bounds(self, lo, hi) -> Tuple[int, int]:
+        # a 1-tuple sorts before every (key, uid) pair sharing its key
+        start = 0 if lo is None else bisect.bisect_left(self._entries, (lo,))
+        end = len(self._entries) if hi is None else bisect.bisect_left(self._entries, (hi,))
+        return start, max(start, end)
+
+    def count(self, lo=None, hi=None) -> int:
+        start, end = self._bounds(lo, hi)
+        return end - start
+
+    def range(self, lo=None, hi=None) -> List[str]:
+        # uids with lo <= key < hi, in key order; None leaves that end open
+        start, end = self._bounds(lo, hi)
+        return [uid for _, uid in self._entries[start:end]]
+
+    def uids(self, reverse: bool = False):
+        entries = reversed(self._entries) if reverse else self._entries
+        return (uid for _, uid in entries)
+
+
+class TermIndex:
+    # Okapi BM25 over memo content; a query term that is also a word of one of
+    # the memo's hashtags adds TAG_BOOST times that term's tag idf
+    K1 = 1.2
+    B = 0.75
+    TAG_BOOST = 2.0
+    # fuzzy matching: at most this many vocabulary terms stand in for one query word
+    MAX_EXPANSIONS = 64
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._tagPostings: Dict[str, Set[str]] = {}
+        # padded bigram -> vocabulary terms containing it, for fuzzy candidates
+        self._grams: Dict[str, Set[str]] = {}
+        # uid -> (content terms, tag terms, content length in tokens)
+        self._docs: Dict[str, tuple] = {}
+        self._totalLength = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    @classmethod
+    def build(cls, items) -> 'TermIndex':
+        # from (uid, content, hashtags) rows
+        index = cls()
+        for uid, content, hashtags in items:
+            index.add(uid, content, hashtags)
+        return index
+
+    def add(self, uid: str, content: str, hashtags: List[str]):
+        self.remove(uid)
+        tokens = tokenize(content)
+        terms = Counter(tokens)
+        for term, tf in terms.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                if term not in self._tagPostings:
+                    self._addTerm(term)
+            posting[uid] = tf
+
+        tagTerms = set()
+        for tag in hashtags:
+            tagTerms.update(tokenize(tag))
+        for term in tagTerms:
+            uids = self._tagPostings.get(term)
+            if uids is None:
+                uids = self._tagPostings[term] = set()
+                if term not in self._postings:
+                    self._addTerm(term)
+            uids.add(uid)
+
+        self._docs[uid] = (tuple(terms), tuple(tagTerms), len(tokens))
+        self._totalLength += len(tokens)
+
+    def remove(self, uid: str):
+        doc = self._docs.pop(uid, None)
+        if doc is None:
+            return
+
+        terms, tagTerms, length = doc
+        self._totalLength -= length
+        for term in terms:
+            posting = self._postings[term]
+            del posting[uid]
+            if not posting:
+                del self._postings[term]
+                if term not in self._tagPostings:
+                    self._dropTerm(term)
+        for term in tagTerms:
+            uids = self._tagPostings[term]
+            uids.discard(uid)
+            if not uids:
+                del self._tagPostings[term]
+                if term not in self._postings:
+                    self._dropTerm(term)
+
+    @staticmethod
+    def _bigrams(term: str) -> Set[str]:
+        padded = f"\x00{term}\x00"
+        return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+    @staticmethod
+    def _fuzzable(term: str) -> bool:
+        # CJK bigrams are too short to misspell meaningfully
+        return not _CJK_CHAR.match(term)
+
+    def _addTerm(self, term: str):
+        if self._fuzzable(term):
+            for g in self._bigrams(term):
+                self._grams.setdefault(g, set()).add(term)
+
+    def _dropTerm(self, term: str):
+        if self._fuzzable(term):
+            for g in self._bigrams(term):
+                terms = self._grams[g]
+                terms.discard(term)
+                if not terms:
+                    del self._grams[g]
+
+    @staticmethod
+    def tolerance(word: str) -> int:
+        if len(word) <= 3:
+            return 0
+        return 1 if len(word) <= 7 else 2
+
+    def similar(self, word: str, deadline: float = None) -> List[str]:
+        # vocabulary terms within tolerance(word) edits of `word`, closest first.
+        # Each edit breaks at most three padded bigrams (a swap of neighbours
+        # does), so a term within d edits shares at least max(len) + 1 - 3d of
+        # them; only those get verified
+        limit = self.tolerance(word)
+        if limit == 0 or not self._fuzzable(word):
+            return [word] if word in self._postings or word in self._tagPostings else []
+
+        shared = Counter()
+        for g in self._bigrams(word):
+            shared.update(self._grams.get(g, ()))
+
+        found = []
+        for i, (term, count) in enumerate(shared.most_common()):
+            if count < max(len(word), len(term)) + 1 - 3 * limit:
+                continue
+            if deadline is not None and i % 64 == 0 and time.perf_counter() > deadline:
+                break
+            dist = bounded_levenshtein(word, term, limit)
+            if dist <= limit:
+                found.append((dist, term))
+        found.sort()
+        return [term for _, term in found[:self.MAX_EXPANSIONS]]
+
+    def fuzzy(self, query: str, deadline: float = None) -> Set[str]:
+        # uids holding, for every query word, some term within its tolerance
+        result = None
+        for word in set(tokenize(query, query=True)):
+            uids = set()
+            for term in self.similar(word, deadline):
+                uids.update(self._postings.get(term, ()))
+                uids.update(self._tagPostings.get(term, ()))
+            result = uids if result is None else result & uids
+            if not result:
+                return set()
+        return result or set()
+
+    def _idf(self, df: int) -> float:
+        n = len(self._docs)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def rank(self, query: str, k: int, within: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        # the k best (uid, score) pairs, best first; only uids in `within` if given
+        if not self._docs:
+            return []
+
+        k1, b = self.K1, self.B
+        avgLength = self._totalLength / len(self._docs) or 1
+        docs = self._docs
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query, query=True)):
+            posting = self._postings.get(term)
+            if posting:
+                idf = self._idf(len(posting))
+                for uid, tf in posting.items():
+                    if within is not None and uid not in within:
+                        continue
+                    norm = k1 * (1 - b + b * docs[uid][2] / avgLength)
+                    scores[uid] = scores.get(uid, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+            tagged = self._tagPostings.get(term)
+            if tagged:
+                boost = self.TAG_BOOST * self._idf(len(tagged))
+                for uid in tagged:
+                    if within is not None and uid not in within:
+                        continue
+                    scores[uid] = scores.get(uid, 0.0) + boost
+
+        return heapq.nlargest(k, scores.items(), key=itemgetter(1))
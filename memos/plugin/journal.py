@@ -0,0 +1,60 @@
+"""
+Append-only edit journal.
+
+Mutations are written as one compact JSON record per line to a single
+annotation and replayed over the shard snapshot on load. Replaying a record
+sets state rather than changing it, so a journal that outlives its compaction
+(shards written, journal not yet cleared) replays harmlessly.
+
+    ["a", uid, rank, content, hashtags, created, modified]
+    ["u", uid, content, hashtags, modified]
+    ["d", uid]
+    ["m", uid, rank]    one memo moved
+    ["o", [uid, ...]]   full order after a reorder; ranks are spread afresh
+    ["o", [uid, ...], [rank, ...]]   ranks restored by an undo
+    ["r", uid, ...]     a revision history change (see revisions.py)
+"""
+
+import json
+from typing import List
+
+KEY = "krita_memos_journal"
+HEADER = b"KMJ1\n"
+
+# compact once the journal holds more than this many bytes...
+MAX_BYTES = 1024 * 1024
+# ...or more records than this fraction of the memo count (and at least MIN_RECORDS)
+RATIO = 0.5
+MIN_RECORDS = 256
+
+
+def encode(records: List[list]) -> bytes:
+    return b"".join(
+        json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        for rec in records
+    )
+
+
+def decode(data: bytes, header: bytes = HEADER) -> List[list]:
+    if not data:
+        return []
+    data = bytes(data)
+    if not data.startswith(header):
+        raise ValueError("not a memo journal")
+
+    records = []
+    for line in data[len(header):].split(b"\n"):
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line.decode("utf-8")))
+        except ValueError:
+            # a torn tail; everything before it is still good
+            break
+    return records
+
+
+def full(nbytes: int, records: int, memos: int) -> bool:
+    if nbytes > MAX_BYTES:
+        return True
+    return records > max(MIN_RECORDS, RATIO * memos)
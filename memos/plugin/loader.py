@@ -0,0 +1,70 @@
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class LoadJob:
+
+    def __init__(self, store, data):
+        self.store = store
+        self.data = data
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class StoreLoader(QObject):
+    # emitted from the worker thread; Qt queues it onto the GUI thread
+    finished = pyqtSignal(object)
+    indexBuilt = pyqtSignal(object, str, object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.finished.connect(self._onFinished)
+        self.indexBuilt.connect(self._onIndexBuilt)
+
+    def start(self, store) -> LoadJob:
+        # the annotation has to be read here, on the GUI thread
+        job = LoadJob(store, store.read_raw())
+        store.loading = True
+        store.loadJob = job
+        thread = threading.Thread(target=self._run, args=(job,), daemon=True)
+        thread.start()
+        return job
+
+    def _run(self, job):
+        try:
+            job.result = job.store.decode(job.data, lambda: job.cancelled)
+        except Exception as e:
+            job.error = e
+        job.data = None
+        self.finished.emit(job)
+
+    def _onFinished(self, job):
+        store = job.store
+        if job.cancelled or store.loadJob is not job:
+            return
+
+        store.loadJob = None
+        if job.error is not None:
+            print(f"[Memos] Load error: {job.error}")
+            store.apply_loaded(store.decode(None))
+            return
+        store.apply_loaded(job.result)
+        # the list is usable as soon as the memos are in; search catches up
+        # once this has started the text index (unless a search already has)
+        store.index_ready("text")
+
+    def buildIndex(self, store, name):
+        token, snapshot = store.index_snapshot(name)
+
+        def run():
+            self.indexBuilt.emit(store, name, token, store.build_index(name, snapshot))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _onIndexBuilt(self, store, name, token, index):
+        store.install_index(name, index, token)
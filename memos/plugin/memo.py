@@ -1,17 +1,181 @@
-import json
+import bisect
+import time
+import weakref
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Optional, Tuple
 from krita import Krita
 
+from . import codec, journal, ranks, revisions, shards, undo, wal
+from .indexes import TrigramIndex, TagIndex, TermIndex, SortedIndex
+from .persist import WriteBehind
+from .query import Query, parse_query
+
 
 class Memo:
+    __slots__ = (
+        "uid", "_src", "_idx", "_content", "_hashtags", "_created", "_modified",
+        "_lower", "_tagsLower", "_tagSet", "_preview", "_createdUs", "_modifiedUs", "_modifiedLabel",
+    )
+
+    PREVIEW_LEN = 50
+
     def __init__(self, content: str, hashtags: List[str] = None,
-                 uid: str = None, created: str = None):
+                 uid: str = None, created: str = None, modified: str = None):
         self.uid = uid or self._gen_uid()
+        self._src = None
+        self._idx = 0
+        self._created = created or datetime.now().isoformat()
+        self._createdUs = None
         self.content = content
         self.hashtags = hashtags or []
-        self.created = created or datetime.now().isoformat()
-        self.modified = datetime.now().isoformat()
+        self.modified = modified or datetime.now().isoformat()
+
+    @classmethod
+    def from_record(cls, records, i: int) -> 'Memo':
+        # fields stay in `records` until first accessed
+        memo = cls.__new__(cls)
+        memo.uid = records.uids[i] or cls._gen_uid()
+        memo._src = records
+        memo._idx = i
+        memo._created = None
+        memo._createdUs = None
+        memo._clearContent(None)
+        memo._clearTags(None)
+        memo._clearModified(None)
+        return memo
+
+    # setters drop the derived values cached from the field they replace
+
+    def _clearContent(self, value):
+        self._content = value
+        self._lower = None
+        self._preview = None
+
+    def _clearTags(self, value):
+        self._hashtags = value
+        self._tagsLower = None
+        self._tagSet = None
+
+    def _clearModified(self, value):
+        self._modified = value
+        self._modifiedUs = None
+        self._modifiedLabel = None
+
+    @property
+    def content(self) -> str:
+        if self._content is None:
+            self._content = self._src.content(self._idx)
+        return self._content
+
+    @content.setter
+    def content(self, value: str):
+        self._clearContent(value)
+
+    @property
+    def hashtags(self) -> List[str]:
+        if self._hashtags is None:
+            self._hashtags = self._src.hashtags(self._idx)
+        return self._hashtags
+
+    @hashtags.setter
+    def hashtags(self, value: List[str]):
+        self._clearTags(value)
+
+    @property
+    def created(self) -> str:
+        if self._created is None:
+            self._created = self._src.created(self._idx) or datetime.now().isoformat()
+        return self._created
+
+    @created.setter
+    def created(self, value: str):
+        self._created = value
+        self._createdUs = None
+
+    @property
+    def modified(self) -> str:
+        if self._modified is None:
+            self._modified = self._src.modified(self._idx) or self.created
+        return self._modified
+
+    @modified.setter
+    def modified(self, value: str):
+        self._clearModified(value)
+
+    def fields(self) -> tuple:
+        # (content, hashtags) as far as they are materialized, None where not
+        return self._content, self._hashtags
+
+    def index_row(self, content: str, hashtags: List[str]) -> tuple:
+        # (uid, content, hashtags) from fields() taken earlier, safe off the GUI
+        # thread: what was not materialized then is read from the records,
+        # which never change, without caching it here
+        if content is None:
+            content = self._src.content(self._idx)
+        if hashtags is None:
+            hashtags = self._src.hashtags(self._idx)
+        return self.uid, content, hashtags
+
+    @property
+    def length(self) -> int:
+        # len(content), without materializing it
+        if self._content is None:
+            return self._src.content_length(self._idx)
+        return len(self._content)
+
+    @property
+    def lower(self) -> str:
+        if self._lower is None:
+            self._lower = self.content.lower()
+        return self._lower
+
+    @property
+    def tags_lower(self) -> tuple:
+        if self._tagsLower is None:
+            self._tagsLower = tuple(t.lower() for t in self.hashtags)
+        return self._tagsLower
+
+    @property
+    def tag_set(self) -> frozenset:
+        if self._tagSet is None:
+            self._tagSet = frozenset(self.hashtags)
+        return self._tagSet
+
+    @property
+    def preview(self) -> str:
+        if self._preview is None:
+            content = self.content
+            preview = content[:self.PREVIEW_LEN].replace("\n", " ")
+            if len(content) > self.PREVIEW_LEN:
+                preview += "..."
+            self._preview = preview
+        return self._preview
+
+    @property
+    def created_us(self) -> int:
+        # microseconds since 1970-01-01, in the same naive local time as `created`
+        if self._createdUs is None:
+            if self._created is None and self._src is not None:
+                self._createdUs = self._src.created_us(self._idx)
+            if self._createdUs is None:
+                self._createdUs = codec.iso_to_us(self.created)
+        return self._createdUs
+
+    @property
+    def modified_us(self) -> int:
+        if self._modifiedUs is None:
+            if self._modified is None and self._src is not None:
+                self._modifiedUs = self._src.modified_us(self._idx)
+            if self._modifiedUs is None:
+                self._modifiedUs = codec.iso_to_us(self.modified)
+        return self._modifiedUs
+
+    @property
+    def modified_label(self) -> str:
+        if self._modifiedLabel is None:
+            self._modifiedLabel = datetime.fromisoformat(self.modified).strftime("%Y/%m/%d %H:%M:%S")
+        return self._modifiedLabel
 
     @staticmethod
     def _gen_uid():
@@ -33,101 +197,1066 @@ class Memo:
             content=data["content"],
             hashtags=data.get("hashtags", []),
             uid=data.get("uid"),
-            created=data.get("created")
+            created=data.get("created"),
+            modified=data.get("modified")
         )
 
     def matches(self, query: str) -> bool:
         ql = query.lower()
-        if ql in self.content.lower():
+        if ql in self.lower:
             return True
-        for tag in self.hashtags:
-            if ql in tag.lower():
+        for tag in self.tags_lower:
+            if ql in tag:
                 return True
         return False
 
 
 class MemoStore:
     ANNOTATION_KEY = "krita_memos_data"
+    # a full journal is folded back into the shards once editing pauses
+    COMPACT_IDLE_MS = 10000
+    COMPACT_MAX_LATENCY_MS = 60000
+    # fuzzy search stops widening typos once it has spent this long
+    FUZZY_BUDGET_MS = 30
+    # display orders: manual is the reverse of store order (newest first), the
+    # dates newest first, alpha A to Z by content
+    SORT_MODES = ("manual", "modified", "created", "alpha")
+    # search indexes that can be built off the GUI thread, by name
+    INDEXES = {"text": TrigramIndex, "terms": TermIndex}
+    # resident_bytes(): per memo (object, uid, rank and their dict entries),
+    # per character of content, and what each built index adds on top
+    MEMO_BYTES = 900
+    CHAR_BYTES = 2
+    TEXT_INDEX_CHAR_BYTES = 7
+    TERM_INDEX_CHAR_BYTES = 18
+    SORTED_INDEX_MEMO_BYTES = 250
 
     def __init__(self):
-        self.memos: List[Memo] = []
+        # uid -> Memo, kept in display order; `memos` is a cached list view of it
+        self._memos: Dict[str, Memo] = {}
+        self._list: Optional[List[Memo]] = []
+        # total length of their contents, for resident_bytes()
+        self._chars = 0
+        # uid -> persistent rank (see ranks.py); store order is ascending rank
+        self._rank: Dict[str, str] = {}
+        # built on first search, or in the background after a load
+        self._text: Optional[TrigramIndex] = None
+        # BM25 terms for ranked and fuzzy search, built on the first such query
+        self._terms: Optional[TermIndex] = None
+        # "text" or "terms" -> uids changed while that index is built off the GUI thread
+        self._pending: Dict[str, set] = {}
+        # starts such a build (loader.StoreLoader); None builds them in place
+        self.builder = None
+        # "created", "modified", "alpha" -> SortedIndex, each built on first use
+        self._sorted: Dict[str, SortedIndex] = {}
+        self._tags = TagIndex()
+        self.writer = WriteBehind(self.save)
+        # format of the annotation as read; save always writes codec.VERSION
+        self.loadedVersion = None
+        self.loadedBytes = 0
+        self._observers = []
+        # bumped on every mutation, for callers caching derived results
+        self.version = 0
+        # set while a background load is filling this store
+        self.loading = False
+        self.loadJob = None
+        # uids touched inside batch(); indexing, saving and notifying wait for the commit
+        self._batch: Optional[set] = None
+        self._batchDepth = 0
+        self._batchDirty = False
+        # shard count of the loaded layout (None: single legacy annotation) and
+        # the shards that have changed since the last save
+        self.shardCount: Optional[int] = None
+        self._shardMembers: Optional[Dict[int, set]] = None
+        self._dirtyShards = set()
+        self._allDirty = False
+        # autosaves append to the journal; compaction rewrites the dirty shards
+        # and clears it. The queue holds records not yet written, and is None
+        # when the memos were replaced wholesale and only a snapshot will do
+        self.journaling = True
+        self._journal = bytearray()
+        self._journalRecords = 0
+        self._journalQueue: Optional[list] = []
+        self.compactor = WriteBehind(self.compact, self.COMPACT_IDLE_MS, self.COMPACT_MAX_LATENCY_MS)
+        self.compactions = 0
+        # sidecar log of changes not yet in a saved .kra; None for unsaved documents
+        self.wal: Optional[wal.SidecarLog] = None
+        # reverting ops for undo()/redo(); cleared whenever the memos are replaced
+        self.undoStack = undo.UndoStack()
+        # earlier versions of each memo, saved with the document
+        self.keepRevisions = revisions.ENABLED
+        self.history = revisions.RevisionLog()
         self.doc = None
 
+    @property
+    def memos(self) -> List[Memo]:
+        if self._list is None:
+            self._list = list(self._memos.values())
+        return self._list
+
+    @memos.setter
+    def memos(self, memos: List[Memo]):
+        self._install(self._build(memos))
+        self._allDirty = True
+
+    @staticmethod
+    def _build(memos: List[Memo]):
+        # builds everything a store holds without touching one, so it can run in a worker
+        byUid = {m.uid: m for m in memos}
+        tags = TagIndex.build((m.uid, m.hashtags) for m in byUid.values())
+        return byUid, tags, sum(m.length for m in byUid.values())
+
+    def _install(self, built, rank: Dict[str, str] = None, history: revisions.RevisionLog = None):
+        byUid, tags, chars = built
+        # keep the tag version increasing so cached tag lists are never mistaken as current
+        tags.version += self._tags.version + 1
+        self._memos = byUid
+        self._chars = chars
+        self._list = None
+        self._text = None
+        self._terms = None
+        self._pending = {}
+        self._sorted = {}
+        self._tags = tags
+        self._shardMembers = None
+        self._dirtyShards = set()
+        self._journalQueue = None
+        if rank is None:
+            self._respread()
+        else:
+            self._rank = rank
+        self.undoStack.clear()
+        self.history = history if history is not None else revisions.RevisionLog()
+        self._notify("reset")
+
+    def _searchIndex(self, name: str):
+        # None while a background build runs, which is started here if need be
+        # and reused until it is installed
+        if name not in self._pending and self._built(name) is None:
+            if self.builder is not None and not self.loading:
+                self.builder.buildIndex(self, name)
+            else:
+                self._setBuilt(name, self.build_index(name, self._fields()))
+        return self._built(name)
+
+    def _built(self, name: str):
+        return self._text if name == "text" else self._terms
+
+    def _setBuilt(self, name: str, index):
+        if name == "text":
+            self._text = index
+        else:
+            self._terms = index
+
+    def index_ready(self, name: str) -> bool:
+        # whether searches use index `name` yet; until then the text index
+        # falls back to checking memos one by one, the term index to exact matches
+        return self._searchIndex(name) is not None
+
+    def index_snapshot(self, name: str):
+        # what build_index needs, taken on the GUI thread; changes made after
+        # this are tracked under the returned token and replayed on install.
+        # Fields a memo has not read from its records yet are left to the
+        # worker, so taking it materializes nothing
+        token = self._pending[name] = set()
+        return token, self._fields()
+
+    def _fields(self) -> list:
+        return [(m,) + m.fields() for m in self._memos.values()]
+
+    @classmethod
+    def build_index(cls, name: str, snapshot):
+        return cls.INDEXES[name].build(m.index_row(content, hashtags) for m, content, hashtags in snapshot)
+
+    def install_index(self, name: str, index, token) -> bool:
+        if self._pending.get(name) is not token:
+            return False
+        del self._pending[name]
+        for uid in token:
+            m = self._memos.get(uid)
+            if m is None:
+                index.remove(uid)
+            else:
+                index.add(uid, m.content, m.hashtags)
+        self._setBuilt(name, index)
+        # results read until now came from a fallback
+        self._notify("indexed")
+        return True
+
+    @staticmethod
+    def _sortValue(field: str, memo: Memo):
+        if field == "created":
+            return memo.created_us
+        if field == "modified":
+            return memo.modified_us
+        return memo.lower
+
+    def _sortedIndex(self, field: str) -> SortedIndex:
+        index = self._sorted.get(field)
+        if index is None:
+            index = SortedIndex.build((m.uid, self._sortValue(field, m)) for m in self._memos.values())
+            self._sorted[field] = index
+        return index
+
+    def subscribe(self, callback):
+        # callback(event, uid) with event one of "add", "update", "delete",
+        # "reorder" (uid of the moved memo, or None), "reset" or "indexed"
+        # (uid None; the latter when a search index built in the background is in);
+        # bound methods are held weakly
+        if hasattr(callback, "__self__"):
+            ref = weakref.WeakMethod(callback)
+        else:
+            def ref():
+                return callback
+        self._observers.append(ref)
+
+    def unsubscribe(self, callback):
+        self._observers = [ref for ref in self._observers if ref() not in (None, callback)]
+
+    def observed(self) -> bool:
+        return any(ref() is not None for ref in self._observers)
+
+    def _notify(self, event: str, uid: str = None):
+        if self._batch is not None:
+            return
+        self.version += 1
+        for ref in self._observers[:]:
+            fn = ref()
+            if fn is None:
+                continue
+            try:
+                fn(event, uid)
+            except Exception as e:
+                print(f"[Memos] Observer error: {e}")
+                import traceback
+                traceback.print_exc()
+        self._observers = [ref for ref in self._observers if ref() is not None]
+
+    def _respread(self):
+        self._rank = dict(zip(self._memos, ranks.spread(len(self._memos))))
+
+    def _index(self, memo: Memo):
+        if self._batch is not None:
+            self._batch.add(memo.uid)
+            return
+        if self._text is not None:
+            self._text.add(memo.uid, memo.content, memo.hashtags)
+        if self._terms is not None:
+            self._terms.add(memo.uid, memo.content, memo.hashtags)
+        for pending in self._pending.values():
+            pending.add(memo.uid)
+        for field, index in self._sorted.items():
+            index.add(memo.uid, self._sortValue(field, memo))
+        self._tags.add(memo.uid, memo.hashtags)
+
+    def _unindex(self, uid: str):
+        if self._batch is not None:
+            self._batch.add(uid)
+            return
+        if self._text is not None:
+            self._text.remove(uid)
+        if self._terms is not None:
+            self._terms.remove(uid)
+        for pending in self._pending.values():
+            pending.add(uid)
+        for index in self._sorted.values():
+            index.remove(uid)
+        self._tags.remove(uid)
+
+    def _ordered(self, uids) -> List[Memo]:
+        rank = self._rank
+        return [self._memos[uid] for uid in sorted(uids, key=rank.__getitem__)]
+
+    def __len__(self):
+        return len(self._memos)
+
+    def __contains__(self, uid: str):
+        return uid in self._memos
+
     def set_document(self, doc):
+        self.flush()
         self.doc = doc
         self.load()
 
     def load(self):
+        try:
+            loaded = self.decode(self.read_raw())
+        except Exception as e:
+            print(f"[Memos] Load error: {e}")
+            loaded = self.decode(None)
+        self.apply_loaded(loaded)
+
+    def read_raw(self):
+        # Krita objects may only be touched from the GUI thread; the sidecar log
+        # is opened here too, its records are read along with the annotations
+        if self.wal is not None:
+            self.wal.sync()
+        self.wal = None
         if not self.doc:
-            self.memos = []
-            return
+            return None
+        self.wal = wal.SidecarLog.open(self.doc.fileName())
+        shardCount, blobs = shards.read(self.doc, self.ANNOTATION_KEY)
+        data = self.doc.annotation(journal.KEY) if shardCount is not None else None
+        history = [bytes(self.doc.annotation(revisions.shard_key(i)) or b"") for i in range(revisions.SHARDS)]
+        return shardCount, blobs, bytes(data) if data else b"", self.wal.path if self.wal else None, history
 
-        try:
-            data = self.doc.annotation(self.ANNOTATION_KEY)
+    @classmethod
+    def decode(cls, raw, cancelled=None):
+        # pure function of read_raw()'s result; returns None if `cancelled()` turned true
+        shardCount, blobs, journalData, walPath, historyData = raw if raw is not None else (None, [], b"", None, [])
+        version = None
+        nbytes = 0
+        memos = []
+        order = []
+        for data in blobs:
             if not data:
-                self.memos = []
+                continue
+            version, records = codec.decode(data)
+            nbytes += len(data)
+            base = len(order)
+            for i in range(len(records)):
+                if cancelled is not None and i % 1000 == 0 and cancelled():
+                    return None
+                memos.append(Memo.from_record(records, i))
+            order.extend(records.order if records.order is not None else range(base, base + len(records)))
+        if cancelled is not None and cancelled():
+            return None
+
+        if shardCount is not None:
+            # shards hold interleaved memos; their stored ranks restore the order
+            pairs = sorted(zip(order, range(len(memos))))
+            memos = [memos[i] for _, i in pairs]
+            order = [o for o, _ in pairs]
+        if any(not isinstance(o, str) for o in order):
+            # v1 data or an unranked single key: give out fresh ranks and
+            # rewrite everything on the next save, like a single-key document
+            order = ranks.spread(len(memos))
+            shardCount = None
+        rank = {m.uid: o for m, o in zip(memos, order)}
+
+        # the journal extends the shards, and the sidecar log (left by a crash)
+        # extends what was in the document when it was last saved
+        records = journal.decode(journalData)
+        recovered = wal.read(walPath)
+        touched = set()
+        if records or recovered:
+            byUid = {m.uid: m for m in memos}
+            touched = cls._replay(byUid, rank, records)
+            more = cls._replay(byUid, rank, recovered)
+            touched = None if touched is None or more is None else touched | more
+            memos = [byUid[uid] for uid in sorted(byUid, key=rank.__getitem__)]
+        replayed = (journalData, len(records), touched, recovered)
+
+        blobs = {}
+        for data in historyData:
+            try:
+                blobs.update(revisions.decode(data))
+            except ValueError as e:
+                # losing old versions must not cost the memos themselves
+                print(f"[Memos] Revision history unreadable: {e}")
+        history = revisions.RevisionLog(blobs)
+        history.replay(rec for rec in records + recovered if rec[0] == "r")
+        return version, nbytes, cls._build(memos), rank, shardCount, replayed, history
+
+    @staticmethod
+    def _replay(byUid: Dict[str, Memo], rank: Dict[str, str], records) -> Optional[set]:
+        # applies journal records over a snapshot; returns the uids they touched,
+        # or None once a reorder has re-ranked every memo
+        touched = set()
+        for rec in records:
+            op = rec[0]
+            if op == "a":
+                _, uid, r, content, hashtags, created, modified = rec
+                byUid[uid] = Memo(content, hashtags, uid, created, modified)
+                rank[uid] = r
+            elif op == "m":
+                uid = rec[1]
+                if uid not in byUid:
+                    continue
+                rank[uid] = rec[2]
+            elif op == "u":
+                uid = rec[1]
+                m = byUid.get(uid)
+                if m is None:
+                    continue
+                m.content, m.hashtags, m.modified = rec[2], rec[3], rec[4]
+            elif op == "d":
+                uid = rec[1]
+                byUid.pop(uid, None)
+                rank.pop(uid, None)
+            elif op == "o" and len(rec) > 2:
+                # exact ranks, as an undone reorder restores them
+                rank.update((uid, r) for uid, r in zip(rec[1], rec[2]) if uid in byUid)
+                touched = None
+                continue
+            elif op == "o":
+                listed = {uid: None for uid in rec[1] if uid in byUid}
+                order = list(listed) + [uid for uid in sorted(byUid, key=rank.__getitem__) if uid not in listed]
+                rank.clear()
+                rank.update(zip(order, ranks.spread(len(order))))
+                touched = None
+                continue
+            else:
+                continue
+            if touched is not None:
+                touched.add(uid)
+        return touched
+
+    def apply_loaded(self, loaded):
+        version, nbytes, built, rank, shardCount, replayed, history = loaded
+        journalData, journalRecords, touched, recovered = replayed
+        self.loadedVersion = version
+        self.loadedBytes = nbytes
+        self.loading = False
+        self.shardCount = shardCount
+        self._install(built, rank, history)
+        # a single-key document is migrated to shards on its next save; the
+        # shards a replayed journal changed are rewritten on the next compaction
+        self._allDirty = shardCount is None or touched is None
+        if shardCount is not None:
+            self._dirtyShards = {shards.shard_of(uid, shardCount) for uid in touched or ()}
+            self._journalQueue = []
+        self._journal = bytearray(journalData)
+        self._journalRecords = journalRecords
+        if recovered:
+            # changes the crashed session never got into a saved file
+            print(f"[Memos] Recovered {len(recovered)} change(s) from the sidecar log")
+            if self._journalQueue is not None:
+                self._journalQueue.extend(recovered)
+            self._touch()
+        if self.doc and self._journalFull():
+            self.compactor.schedule()
+
+    def _touch(self):
+        # mutations are persisted write-behind; see WriteBehind for the policy
+        if self._batch is not None:
+            self._batchDirty = True
+        elif self.doc:
+            self.writer.schedule()
+
+    @contextmanager
+    def batch(self):
+        # groups mutations into one change: each touched memo is re-indexed once,
+        # the annotation is written once and observers get a single "reset" when
+        # the outermost batch exits; searches inside a batch see the old state.
+        # An exception reverts what this batch did before it propagates.
+        if self._batch is None:
+            self._batch = set()
+            self._batchDirty = False
+            self.undoStack.begin()
+        self._batchDepth += 1
+        mark = self.undoStack.mark()
+        try:
+            yield self
+        except BaseException:
+            for op in reversed(self.undoStack.abort(mark)):
+                self._revert(op)
+            self._batchDepth -= 1
+            if self._batchDepth == 0:
+                self._abortBatch()
+            raise
+        self._batchDepth -= 1
+        if self._batchDepth == 0:
+            self._commitBatch()
+
+    def _abortBatch(self):
+        # the indexes never saw the reverted changes; the journal holds them
+        # along with their reverts and goes out with the next write
+        self._batch = None
+        self._batchDirty = False
+        self.undoStack.end()
+
+    def _commitBatch(self):
+        uids, dirty = self._batch, self._batchDirty
+        self._batch = None
+        self._batchDirty = False
+        self.undoStack.end()
+        for uid in uids:
+            m = self._memos.get(uid)
+            if m is None:
+                self._unindex(uid)
+            else:
+                self._index(m)
+        if dirty:
+            self.save()
+        if uids or dirty:
+            self._notify("reset")
+
+    def flush(self):
+        # the journal is a complete record, so a pending compaction can wait
+        return self.writer.flush()
+
+    def persist_stats(self) -> Dict:
+        stats = self.writer.stats()
+        stats["journalBytes"] = len(self._journal)
+        stats["journalRecords"] = self._journalRecords
+        stats["compactions"] = self.compactions
+        stats["revisionBytes"] = self.history.stats()["storedBytes"]
+        return stats
+
+    def resident_bytes(self) -> int:
+        # rough memory held by this store, indexes included; the factors were
+        # measured with tracemalloc on typical memos
+        count = len(self._memos)
+        size = count * self.MEMO_BYTES + self._chars * self.CHAR_BYTES
+        if self._text is not None:
+            size += self._chars * self.TEXT_INDEX_CHAR_BYTES
+        if self._terms is not None:
+            size += self._chars * self.TERM_INDEX_CHAR_BYTES
+        size += len(self._sorted) * count * self.SORTED_INDEX_MEMO_BYTES
+        return size + self.undoStack.stats()["bytes"] + self.history.stats()["storedBytes"]
+
+    def set_journaling(self, enabled: bool):
+        self.flush()
+        self.journaling = enabled
+        if not enabled and self._journal:
+            self.compact()
+
+    def _log(self, record: list):
+        if self._journalQueue is not None:
+            self._journalQueue.append(record)
+        if self.wal is not None:
+            self.wal.append(record)
+
+    def document_saved(self):
+        # whatever reached the annotations is in the saved file now; the log
+        # keeps only the changes still waiting for the write-behind flush
+        log = self.wal
+        fileName = self.doc.fileName() if self.doc else ""
+        if log is not None and log.path != wal.path_for(fileName):
+            # saved under a new name; the old file never got these changes
+            log.discard()
+            log = None
+        if log is None:
+            log = self.wal = wal.SidecarLog.open(fileName)
+            if log is None:
                 return
+        if self._journalQueue is not None:
+            log.reset(self._journalQueue)
 
-            dataStr = bytes(data).decode('utf-8')
-            parsed = json.loads(dataStr)
-            self.memos = [Memo.from_dict(m) for m in parsed.get("memos", [])]
-        except Exception as e:
-            print(f"[Memos] Load error: {e}")
-            self.memos = []
+    def document_closed(self) -> bool:
+        # closed without a crash: changes in the annotations were offered for
+        # saving and discarded on purpose, but ones still waiting for the
+        # write-behind flush never were, so the log keeps those for the next
+        # open; returns whether it did
+        log, self.wal = self.wal, None
+        if log is None:
+            return False
+        if self.writer.pending:
+            self.writer.cancel()
+            if self._journalQueue is None:
+                # nothing was written since the memos were replaced
+                log.sync()
+            else:
+                log.reset(self._journalQueue)
+            return True
+        log.discard()
+        return False
+
+    def _journalFull(self) -> bool:
+        return journal.full(len(self._journal), self._journalRecords, len(self._memos))
+
+    def _dirty(self, uid: str):
+        members = self._shardMembers
+        if self.shardCount is None:
+            self._allDirty = True
+            return
+        shard = shards.shard_of(uid, self.shardCount)
+        self._dirtyShards.add(shard)
+        if members is not None:
+            if uid in self._memos:
+                members.setdefault(shard, set()).add(uid)
+            else:
+                members.get(shard, set()).discard(uid)
+
+    def _members(self) -> Dict[int, set]:
+        if self._shardMembers is None:
+            members = {}
+            for uid in self._memos:
+                members.setdefault(shards.shard_of(uid, self.shardCount), set()).add(uid)
+            self._shardMembers = members
+        return self._shardMembers
 
     def save(self):
-        if not self.doc:
+        self.writer.cancel()
+        if not self.doc or self.loading:
+            return
+        if not self.journaling or self._journalQueue is None or self.shardCount is None:
+            self.compact()
+            return
+        if not self._journalQueue:
             return
 
         try:
-            data = {
-                "version": 1,
-                "memos": [m.to_dict() for m in self.memos]
-            }
-            jsonStr = json.dumps(data)
-            jsonBytes = jsonStr.encode('utf-8')
-            self.doc.setAnnotation(self.ANNOTATION_KEY, "memos_data", jsonBytes)
+            if not self._journal:
+                self._journal += journal.HEADER
+            self._journal += journal.encode(self._journalQueue)
+            self._journalRecords += len(self._journalQueue)
+            self._journalQueue = []
+            self.doc.setAnnotation(journal.KEY, "memos_journal", bytes(self._journal))
+            if self._journalFull():
+                self.compactor.schedule()
         except Exception as e:
             print(f"[Memos] Save error: {e}")
             import traceback
             traceback.print_exc()
 
+    def compact(self):
+        # writes the changed shards and drops the journal they supersede
+        self.writer.cancel()
+        self.compactor.cancel()
+        if not self.doc or self.loading:
+            return
+
+        try:
+            if self.shardCount is None:
+                self.shardCount = shards.SHARDS
+                self._shardMembers = None
+                self._allDirty = True
+
+            dirty = range(self.shardCount) if self._allDirty else sorted(self._dirtyShards)
+            members = self._members()
+            rank = self._rank
+            for i in dirty:
+                uids = sorted(members.get(i, ()), key=rank.__getitem__)
+                data = codec.encode([self._memos[uid].to_dict() for uid in uids],
+                                    ranks=[rank[uid] for uid in uids])
+                self.doc.setAnnotation(shards.shard_key(i), "memos_data", data)
+
+            if self._allDirty:
+                # shards first, so a manifest always points at complete shards
+                self.doc.setAnnotation(shards.MANIFEST_KEY, "memos_manifest",
+                                       shards.encode_manifest(self.shardCount))
+                if self.doc.annotation(self.ANNOTATION_KEY):
+                    shards.remove(self.doc, self.ANNOTATION_KEY)
+
+            if self._journal or self.doc.annotation(journal.KEY):
+                shards.remove(self.doc, journal.KEY)
+            self._journal = bytearray()
+            self._journalRecords = 0
+            self._journalQueue = []
+            self.compactions += 1
+            self._saveHistory()
+
+            self._dirtyShards = set()
+            self._allDirty = False
+        except Exception as e:
+            print(f"[Memos] Save error: {e}")
+            import traceback
+            traceback.print_exc()
+
+    def _saveHistory(self):
+        for key, data in self.history.save(self._memos).items():
+            if data:
+                self.doc.setAnnotation(key, "memos_revisions", data)
+            elif self.doc.annotation(key):
+                shards.remove(self.doc, key)
+
     def add(self, memo: Memo):
-        self.memos.append(memo)
-        self.save()
+        old = self._memos.pop(memo.uid, None)
+        if old is not None:
+            self.undoStack.record(self._insertOp(old))
+            self._list = None
+        last = next(reversed(self._memos), None)
+        rank = ranks.after(self._rank[last] if last is not None else None)
+        self.undoStack.record(("delete", memo.uid))
+        self._insert(memo, rank)
+        if len(rank) > ranks.MAX_LEN:
+            self._rerank()
+            self._touch()
+
+    def _insertOp(self, memo: Memo) -> tuple:
+        return ("insert", memo.uid, self._rank[memo.uid], memo.content, list(memo.hashtags), memo.created, memo.modified)
+
+    def _insert(self, memo: Memo, rank: str):
+        last = next(reversed(self._memos), None)
+        self._rank[memo.uid] = rank
+        if last is None or self._rank[last] < rank:
+            self._memos[memo.uid] = memo
+        else:
+            self._reposition(memo.uid, memo)
+        self._list = None
+        self._chars += len(memo.content)
+        self.history.rebase(memo.uid, memo.content)
+        self._index(memo)
+        self._dirty(memo.uid)
+        self._log(["a", memo.uid, rank, memo.content, memo.hashtags, memo.created, memo.modified])
+        self._touch()
+        self._notify("add", memo.uid)
+
+    def _reposition(self, uid: str, memo: Memo):
+        # puts `memo`, absent from _memos, where its rank belongs
+        keys = [self._rank[k] for k in self._memos]
+        items = list(self._memos.items())
+        items.insert(bisect.bisect_left(keys, self._rank[uid]), (uid, memo))
+        self._memos = dict(items)
 
     def update(self, uid: str, content: str, hashtags: List[str]):
-        for m in self.memos:
-            if m.uid == uid:
-                m.content = content
-                m.hashtags = hashtags
-                m.modified = datetime.now().isoformat()
-                self.save()
-                return True
-        return False
+        m = self._memos.get(uid)
+        if m is None:
+            return False
+        if content != m.content or hashtags != m.hashtags:
+            # a run of autosaves to one memo undoes as a single edit
+            key = ("u", uid)
+            merged = self.undoStack.mergeable(key)
+            if merged is not None and merged[1] == uid:
+                before, _ = undo.patch(m.content, merged[2])
+                self.undoStack.replace(("patch", uid, undo.delta(content, before), merged[3], merged[4]))
+            else:
+                self.undoStack.record(("patch", uid, undo.delta(content, m.content), list(m.hashtags), m.modified), key)
+        self._set(uid, content, hashtags, datetime.now().isoformat())
+        return True
+
+    def _set(self, uid: str, content: str, hashtags: List[str], modified: str):
+        m = self._memos[uid]
+        if self.keepRevisions and (content != m.content or hashtags != m.hashtags):
+            self._log(self.history.record(uid, m.content, m.hashtags, m.modified, content, hashtags))
+        self._chars += len(content) - m.length
+        m.content = content
+        m.hashtags = hashtags
+        m.modified = modified
+        self._index(m)
+        self._dirty(uid)
+        self._log(["u", uid, m.content, m.hashtags, m.modified])
+        self._touch()
+        self._notify("update", uid)
 
     def delete(self, uid: str):
-        self.memos = [m for m in self.memos if m.uid != uid]
-        self.save()
+        m = self._memos.get(uid)
+        if m is not None:
+            self.undoStack.record(self._insertOp(m))
+            self._remove(uid)
+
+    def _remove(self, uid: str):
+        self._chars -= self._memos.pop(uid).length
+        self._list = None
+        self._rank.pop(uid, None)
+        self._unindex(uid)
+        self._dirty(uid)
+        self._log(["d", uid])
+        self._touch()
+        self._notify("delete", uid)
+
+    def reorder(self, uids: List[str]):
+        # memos not listed (e.g. hidden by a filter) keep their relative order at the end
+        ordered = {}
+        for uid in uids:
+            m = self._memos.get(uid)
+            if m is not None:
+                ordered[uid] = m
+        for uid, m in self._memos.items():
+            if uid not in ordered:
+                ordered[uid] = m
+        self._memos = ordered
+        self._list = None
+        self._rerank()
+        self._touch()
+        self._notify("reorder")
+
+    def _rerank(self):
+        # fresh, evenly spread ranks for the current order; every shard changes
+        self.undoStack.record(("ranks", dict(self._rank)))
+        self._respread()
+        self._allDirty = True
+        self._log(["o", list(self._memos)])
+
+    def _setRanks(self, rank: Dict[str, str]):
+        self._rank = dict(rank)
+        self._memos = {uid: self._memos[uid] for uid in sorted(self._memos, key=self._rank.__getitem__)}
+        self._list = None
+        self._allDirty = True
+        self._log(["o", list(self._memos), [self._rank[uid] for uid in self._memos]])
+        self._touch()
+        self._notify("reorder")
+
+    def move(self, uid: str, below: str = None, above: str = None) -> bool:
+        # places `uid` right above `below` and right below `above` in store
+        # order (None for an end). Only its rank changes, so memos hidden by a
+        # filter keep their places and one shard is written.
+        if uid not in self._memos or uid in (below, above):
+            return False
+        lo = self._rank.get(below) if below is not None else None
+        hi = self._rank.get(above) if above is not None else None
+        if (below is not None and lo is None) or (above is not None and hi is None):
+            return False
+        if lo is not None and hi is not None and lo >= hi:
+            return False
+
+        rank = ranks.between(lo, hi)
+        self.undoStack.record(("rank", uid, self._rank[uid]))
+        if len(rank) > ranks.MAX_LEN:
+            self._place(uid, rank, notify=False)
+            self._rerank()
+            self._touch()
+            self._notify("reorder", uid)
+        else:
+            self._place(uid, rank)
+        return True
+
+    def _place(self, uid: str, rank: str, notify: bool = True):
+        memo = self._memos.pop(uid)
+        self._rank[uid] = rank
+        self._reposition(uid, memo)
+        self._list = None
+        self._dirty(uid)
+        self._log(["m", uid, rank])
+        if notify:
+            self._touch()
+            self._notify("reorder", uid)
+
+    def undo(self) -> bool:
+        return self._revertStep(self.undoStack.pop_undo(), self.undoStack.push_redo)
+
+    def redo(self) -> bool:
+        return self._revertStep(self.undoStack.pop_redo(), self.undoStack.push_undo)
+
+    def can_undo(self) -> bool:
+        return self.undoStack.can_undo()
+
+    def can_redo(self) -> bool:
+        return self.undoStack.can_redo()
+
+    def _revertStep(self, ops: Optional[list], push) -> bool:
+        # applies a step's ops newest first; what they return reverts the revert
+        if not ops:
+            return False
+        inverse = []
+        with self.batch() if len(ops) > 1 else nullcontext():
+            for op in reversed(ops):
+                inverse.append(self._revert(op))
+        push(inverse)
+        return True
+
+    def _revert(self, op: tuple) -> tuple:
+        kind, uid = op[0], op[1]
+        if kind == "delete":
+            inverse = self._insertOp(self._memos[uid])
+            self._remove(uid)
+        elif kind == "insert":
+            _, uid, rank, content, hashtags, created, modified = op
+            self._insert(Memo(content, list(hashtags), uid, created, modified), rank)
+            inverse = ("delete", uid)
+        elif kind == "patch":
+            m = self._memos[uid]
+            content, hunks = undo.patch(m.content, op[2])
+            inverse = ("patch", uid, hunks, list(m.hashtags), m.modified)
+            self._set(uid, content, list(op[3]), op[4])
+        elif kind == "rank":
+            inverse = ("rank", uid, self._rank[uid])
+            self._place(uid, op[2])
+        else:
+            inverse = ("ranks", dict(self._rank))
+            self._setRanks(uid)
+        return inverse
+
+    def add_many(self, memos: Iterable[Memo]):
+        with self.batch():
+            for memo in memos:
+                self.add(memo)
+
+    def update_many(self, changes: Iterable[Tuple[str, Optional[str], Optional[List[str]]]]) -> int:
+        # (uid, content, hashtags) triples; None keeps the current value
+        count = 0
+        with self.batch():
+            for uid, content, hashtags in changes:
+                m = self._memos.get(uid)
+                if m is None:
+                    continue
+                self.update(uid,
+                            m.content if content is None else content,
+                            m.hashtags if hashtags is None else hashtags)
+                count += 1
+        return count
+
+    def delete_many(self, uids: Iterable[str]) -> int:
+        count = 0
+        with self.batch():
+            for uid in uids:
+                if uid in self._memos:
+                    self.delete(uid)
+                    count += 1
+        return count
+
+    def merge_tags(self, sources: Iterable[str], target: str) -> int:
+        # replaces every tag in `sources` with `target` on the memos carrying it
+        sources = set(sources)
+        uids = set()
+        for tag in sources:
+            uids |= self._tags.uids(tag)
+
+        changes = []
+        for uid in uids:
+            tags = []
+            for tag in self._memos[uid].hashtags:
+                tag = target if tag in sources else tag
+                if tag not in tags:
+                    tags.append(tag)
+            changes.append((uid, None, tags))
+        return self.update_many(changes)
+
+    def rename_tag(self, old: str, new: str) -> int:
+        if old == new:
+            return 0
+        return self.merge_tags([old], new)
+
+    def order_key(self, uid: str) -> str:
+        return self._rank[uid]
+
+    def revisions(self, uid: str) -> List[Tuple[str, List[str]]]:
+        # (modified, hashtags) of the stored earlier versions of `uid`, oldest first
+        m = self._memos.get(uid)
+        return self.history.revisions(uid, m.content) if m is not None else []
+
+    def revision(self, uid: str, index: int) -> Optional[Memo]:
+        # revision `index` of revisions(uid) as a detached Memo
+        m = self._memos.get(uid)
+        if m is None:
+            return None
+        found = self.history.reconstruct(uid, m.content, index)
+        if found is None:
+            return None
+        content, hashtags, modified = found
+        return Memo(content, hashtags, uid, m.created, modified)
+
+    def restore_revision(self, uid: str, index: int) -> bool:
+        # an ordinary, undoable edit back to an earlier version
+        old = self.revision(uid, index)
+        if old is None:
+            return False
+        # the version being replaced keeps a revision of its own, and so does the restore
+        self.undoStack.seal()
+        self.history.seal(uid)
+        self.update(uid, old.content, old.hashtags)
+        self.undoStack.seal()
+        self.history.seal(uid)
+        return True
 
     def get(self, uid: str) -> Optional[Memo]:
-        for m in self.memos:
-            if m.uid == uid:
-                return m
-        return None
+        return self._memos.get(uid)
 
-    def search(self, query: str) -> List[Memo]:
-        if not query:
-            return self.memos[:]
-        return [m for m in self.memos if m.matches(query)]
+    def search(self, query: str, hashtag: str = None, fuzzy: bool = False) -> List[Memo]:
+        # `query` uses the syntax in query.py; fuzzy also lets its words match
+        # terms a few typos away
+        q = parse_query(query)
+        if not q:
+            return self.filter_by_hashtag(hashtag)
+        return self._ordered(self.select(q, hashtag, fuzzy))
+
+    def select(self, q: Query, hashtag: str = None, fuzzy: bool = False) -> set:
+        # uids matching every term of `q` (and `hashtag`). Terms backed by an
+        # index are sources, cheapest first: the smallest one is materialized and
+        # each next one is either intersected or, once the candidates are fewer
+        # than its estimate, checked memo by memo. Everything else is a residual
+        # check on whatever candidates remain.
+        sources = []
+        residual = []
+        excluded = []
+        if hashtag:
+            sources.append((self._tags.count(hashtag), self._tags.uids, hashtag, None))
+        deadline = time.perf_counter() + self.FUZZY_BUDGET_MS / 1000 if fuzzy else None
+        for term in q.terms:
+            if term.kind == "tag":
+                if term.negated:
+                    excluded.append(term.value)
+                else:
+                    sources.append((self._tags.count(term.value), self._tags.uids, term.value, term))
+            elif term.kind == "text" and not term.negated and len(term.value) >= 3 and self.index_ready("text"):
+                text = self._text
+                terms = self._searchIndex("terms") if fuzzy else None
+                if terms is not None:
+                    def fetch(value, text=text, terms=terms):
+                        return text.search(value) | terms.fuzzy(value, deadline)
+                    # typo matches can't be checked per memo, so always fetch them
+                    sources.append((text.estimate(term.value), fetch, term.value, None))
+                else:
+                    sources.append((text.estimate(term.value), text.search, term.value, term))
+            elif term.kind == "date" and not term.negated:
+                index = self._sortedIndex(term.field)
+
+                # bound per term: a query may carry both created: and modified:
+                def fetch(t, index=index):
+                    return set(index.range(t.lo, t.hi))
+                sources.append((index.count(term.lo, term.hi), fetch, term, term))
+            else:
+                residual.append(term)
+
+        sources.sort(key=lambda src: src[0])
+        if sources:
+            estimate, fetch, value, term = sources[0]
+            # an exact source estimated empty is empty; a fuzzy one may still match
+            uids = set(fetch(value)) if estimate or term is None else set()
+        else:
+            uids = set(self._memos)
+
+        memos = self._memos
+        for estimate, fetch, value, term in sources[1:]:
+            if not uids:
+                return uids
+            if term is not None and len(uids) < estimate:
+                uids = {uid for uid in uids if term.test(memos[uid])}
+            else:
+                uids &= fetch(value)
+
+        for tag in excluded:
+            uids -= self._tags.uids(tag)
+        if residual and uids:
+            uids = {uid for uid in uids if all(t.test(memos[uid]) for t in residual)}
+        return uids
+
+    def rank(self, query: str, hashtag: str = None, limit: int = 100) -> List[Memo]:
+        # best `limit` memos for `query` by relevance, best first
+        return [self._memos[uid] for uid, _ in self.rank_scores(query, hashtag, limit)]
+
+    def rank_scores(self, query: str, hashtag: str = None, limit: int = 100) -> List[Tuple[str, float]]:
+        # the query's words are scored; its other terms only filter
+        q = parse_query(query)
+        filters = Query([t for t in q.terms if t.kind != "text" or t.negated], False)
+        within = None
+        if filters or hashtag:
+            within = self.select(filters, hashtag)
+            if not within:
+                return []
+        terms = self._searchIndex("terms")
+        if terms is None:
+            # until the term index is in, exact matches in store order stand in
+            return [(m.uid, 0.0) for m in self._ordered(self.select(q, hashtag))[:limit]]
+        return terms.rank(" ".join(q.words), limit, within)
+
+    def between(self, field: str, lo: int = None, hi: int = None) -> List[Memo]:
+        # memos whose `field` ("created" or "modified", in microseconds as
+        # Memo.created_us) falls in [lo, hi), oldest first
+        return [self._memos[uid] for uid in self._sortedIndex(field).range(lo, hi)]
+
+    def sort_key(self, mode: str):
+        # (key, reverse) such that sorted(memos, key=key, reverse=reverse) is
+        # the display order of `mode`; ties fall back to the uid
+        if mode == "manual":
+            return (lambda m: self._rank[m.uid]), True
+        if mode == "alpha":
+            return (lambda m: (m.lower, m.uid)), False
+        return (lambda m: (self._sortValue(mode, m), m.uid)), True
+
+    def sorted(self, memos: List[Memo], mode: str) -> List[Memo]:
+        key, reverse = self.sort_key(mode)
+        n = len(memos)
+        if mode == "manual" or n * max(1, n.bit_length()) < len(self._memos):
+            return sorted(memos, key=key, reverse=reverse)
+        # a large share of the store: walking the index beats sorting
+        wanted = {m.uid for m in memos}
+        byUid = self._memos
+        return [byUid[uid] for uid in self._sortedIndex(mode).uids(reverse) if uid in wanted]
 
     def filter_by_hashtag(self, hashtag: str) -> List[Memo]:
         if not hashtag:
             return self.memos[:]
-        return [m for m in self.memos if hashtag in m.hashtags]
+        return self._ordered(self._tags.uids(hashtag))
 
     def get_hashtags(self) -> List[str]:
-        tags = set()
-        for m in self.memos:
-            tags.update(m.hashtags)
-        return sorted(tags)
+        return self._tags.tags()[:]
+
+    def hashtag_counts(self) -> Dict[str, int]:
+        return self._tags.counts()
+
+    @property
+    def hashtags_version(self) -> int:
+        return self._tags.version
@@ -0,0 +1,247 @@
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyle, QStyleOptionButton, QApplication
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QSize, QEvent, pyqtSignal
+from PyQt5.QtGui import QPalette, QColor, QCursor
+from krita import Krita
+
+from .i18n import i18n
+
+
+class MemoListModel(QAbstractListModel):
+    UidRole = Qt.UserRole
+    MemoRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.memos = []
+        self._rows = None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.memos)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.memos):
+            return None
+
+        memo = self.memos[index.row()]
+        if role == Qt.DisplayRole:
+            return memo.content
+        if role == self.UidRole:
+            return memo.uid
+        if role == self.MemoRole:
+            return memo
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def moveRows(self, srcParent, srcRow, count, dstParent, dstRow):
+        if srcParent.isValid() or dstParent.isValid():
+            return False
+        if srcRow <= dstRow <= srcRow + count:
+            return False
+        if not self.beginMoveRows(srcParent, srcRow, srcRow + count - 1, dstParent, dstRow):
+            return False
+
+        rows = self.memos[srcRow:srcRow + count]
+        del self.memos[srcRow:srcRow + count]
+        if dstRow > srcRow:
+            dstRow -= count
+        self.memos[dstRow:dstRow] = rows
+        self._rows = None
+
+        self.endMoveRows()
+        return True
+
+    def setMemos(self, memos):
+        self.beginResetModel()
+        self.memos = list(memos)
+        self._rows = None
+        self.endResetModel()
+
+    def sync(self, memos):
+        # keep rows (and with them selection and scroll) when only the order changed
+        memos = list(memos)
+        if len(memos) != len(self.memos) or any(m.uid not in self._rowIndex() for m in memos):
+            self.setMemos(memos)
+            return
+        if all(a is b for a, b in zip(memos, self.memos)):
+            return
+
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        uids = [self.memos[idx.row()].uid for idx in persistent]
+        self.memos = memos
+        self._rows = None
+        self.changePersistentIndexList(persistent, [self.index(self.rowOf(uid)) for uid in uids])
+        self.layoutChanged.emit()
+
+    def insertMemo(self, row, memo):
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.memos.insert(row, memo)
+        self._rows = None
+        self.endInsertRows()
+
+    def removeMemo(self, uid):
+        row = self.rowOf(uid)
+        if row < 0:
+            return False
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.memos[row]
+        self._rows = None
+        self.endRemoveRows()
+        return True
+
+    def memoAt(self, row):
+        if 0 <= row < len(self.memos):
+            return self.memos[row]
+        return None
+
+    def uids(self):
+        return [m.uid for m in self.memos]
+
+    def _rowIndex(self):
+        if self._rows is None:
+            self._rows = {m.uid: i for i, m in enumerate(self.memos)}
+        return self._rows
+
+    def rowOf(self, uid):
+        return self._rowIndex().get(uid, -1)
+
+    def refreshRow(self, row):
+        idx = self.index(row)
+        self.dataChanged.emit(idx, idx)
+
+
+class MemoDelegate(QStyledItemDelegate):
+    copyClicked = pyqtSignal(str)
+    editClicked = pyqtSignal(str)
+    deleteClicked = pyqtSignal(str)
+
+    MARGIN = 4
+    SPACING = 12
+    BTN = 24
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        app = Krita.instance()
+        self.copyIcon = app.icon("edit-copy")
+        self.editIcon = app.icon("document-edit")
+        self.pressed = None
+
+    def buttonRects(self, rect):
+        top = rect.top() + (rect.height() - self.BTN) // 2
+        right = rect.right() - self.MARGIN
+        delete = QRect(right - self.BTN + 1, top, self.BTN, self.BTN)
+        edit = QRect(delete.left() - self.BTN, top, self.BTN, self.BTN)
+        copy = QRect(edit.left() - self.BTN, top, self.BTN, self.BTN)
+        return {"copy": copy, "edit": edit, "delete": delete}
+
+    def hitTest(self, rect, pos):
+        for name, r in self.buttonRects(rect).items():
+            if r.contains(pos):
+                return name
+        return None
+
+    def sizeHint(self, option, index):
+        height = max(self.BTN, option.fontMetrics.height()) + self.MARGIN * 2
+        return QSize(option.rect.width(), height)
+
+    def paint(self, painter, option, index):
+        memo = index.data(MemoListModel.MemoRole)
+        if memo is None:
+            return
+
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawPrimitive(QStyle.PE_PanelItemViewItem, option, painter, widget)
+
+        painter.save()
+        rect = option.rect.adjusted(self.MARGIN, 0, -self.MARGIN, 0)
+        buttons = self.buttonRects(option.rect)
+
+        textColor = option.palette.color(QPalette.WindowText)
+        if option.state & QStyle.State_Selected:
+            textColor = option.palette.color(QPalette.HighlightedText)
+
+        dateFont = painter.font()
+        dateFont.setPixelSize(9)
+        painter.setFont(dateFont)
+        dateColor = QColor(textColor)
+        dateColor.setAlphaF(0.4)
+        painter.setPen(dateColor)
+        dtStr = memo.modified_label
+        dateWidth = painter.fontMetrics().horizontalAdvance(dtStr)
+        dateRect = QRect(rect.left(), rect.top(), dateWidth, rect.height())
+        painter.drawText(dateRect, Qt.AlignLeft | Qt.AlignVCenter, dtStr)
+
+        painter.setFont(option.font)
+        painter.setPen(textColor)
+        textLeft = dateRect.right() + self.SPACING
+        textRect = QRect(textLeft, rect.top(), buttons["copy"].left() - self.SPACING - textLeft, rect.height())
+        preview = painter.fontMetrics().elidedText(memo.preview, Qt.ElideRight, textRect.width())
+        painter.drawText(textRect, Qt.AlignLeft | Qt.AlignVCenter, preview)
+
+        hover = None
+        if widget is not None and option.state & QStyle.State_MouseOver:
+            hover = self.hitTest(option.rect, widget.viewport().mapFromGlobal(QCursor.pos()))
+
+        for name, icon in (("copy", self.copyIcon), ("edit", self.editIcon)):
+            btn = QStyleOptionButton()
+            btn.rect = buttons[name]
+            btn.icon = icon
+            btn.iconSize = QSize(16, 16)
+            btn.state = QStyle.State_Enabled | QStyle.State_Raised
+            if hover == name:
+                btn.state |= QStyle.State_MouseOver
+                if self.pressed == (index.row(), name):
+                    btn.state |= QStyle.State_Sunken
+            btn.palette = option.palette
+            style.drawControl(QStyle.CE_PushButton, btn, painter, widget)
+
+        delFont = painter.font()
+        delFont.setPixelSize(16)
+        delFont.setBold(True)
+        painter.setFont(delFont)
+        painter.setPen(QColor("#ff0000" if hover == "delete" else "#ff7676"))
+        painter.drawText(buttons["delete"], Qt.AlignCenter, "✕")
+
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        etype = event.type()
+        if etype not in (QEvent.MouseButtonPress, QEvent.MouseButtonRelease, QEvent.MouseButtonDblClick):
+            return super().editorEvent(event, model, option, index)
+        if event.button() != Qt.LeftButton:
+            return super().editorEvent(event, model, option, index)
+
+        name = self.hitTest(option.rect, event.pos())
+        if name is None:
+            self.pressed = None
+            return super().editorEvent(event, model, option, index)
+
+        # swallow clicks on the buttons so they neither select nor start a drag
+        if etype == QEvent.MouseButtonPress:
+            self.pressed = (index.row(), name)
+            return True
+        if etype == QEvent.MouseButtonRelease:
+            if self.pressed == (index.row(), name):
+                uid = index.data(MemoListModel.UidRole)
+                {"copy": self.copyClicked, "edit": self.editClicked, "delete": self.deleteClicked}[name].emit(uid)
+            self.pressed = None
+        return True
+
+    def helpEvent(self, event, view, option, index):
+        name = self.hitTest(option.rect, event.pos())
+        if name is not None:
+            from PyQt5.QtWidgets import QToolTip
+            tips = {"copy": i18n("Copy"), "edit": i18n("Edit"), "delete": i18n("Delete")}
+            QToolTip.showText(event.globalPos(), tips[name], view)
+            return True
+        return super().helpEvent(event, view, option, index)
@@ -0,0 +1,71 @@
+import time
+from PyQt5.QtCore import QObject, QTimer
+
+
+class WriteBehind(QObject):
+    # flush once input has been idle this long...
+    IDLE_MS = 1000
+    # ...but never hold a pending change longer than this
+    MAX_LATENCY_MS = 5000
+
+    def __init__(self, flushFn, idleMs=None, maxLatencyMs=None, parent=None):
+        super().__init__(parent)
+        self.flushFn = flushFn
+        self.idleMs = idleMs if idleMs is not None else self.IDLE_MS
+        self.maxLatencyMs = maxLatencyMs if maxLatencyMs is not None else self.MAX_LATENCY_MS
+
+        self.pending = 0
+        self.requests = 0
+        self.flushes = 0
+        self.lastFlushMs = 0.0
+        self.totalFlushMs = 0.0
+
+        self.idleTimer = QTimer(self)
+        self.idleTimer.setSingleShot(True)
+        self.idleTimer.timeout.connect(self.flush)
+
+        self.maxTimer = QTimer(self)
+        self.maxTimer.setSingleShot(True)
+        self.maxTimer.timeout.connect(self.flush)
+
+    def setPolicy(self, idleMs=None, maxLatencyMs=None):
+        if idleMs is not None:
+            self.idleMs = idleMs
+        if maxLatencyMs is not None:
+            self.maxLatencyMs = maxLatencyMs
+
+    def schedule(self):
+        self.requests += 1
+        if self.pending == 0:
+            self.maxTimer.start(self.maxLatencyMs)
+        self.pending += 1
+        self.idleTimer.start(self.idleMs)
+
+    def cancel(self):
+        self.idleTimer.stop()
+        self.maxTimer.stop()
+        self.pending = 0
+
+    def flush(self):
+        self.idleTimer.stop()
+        self.maxTimer.stop()
+        if self.pending == 0:
+            return False
+
+        self.pending = 0
+        start = time.perf_counter()
+        self.flushFn()
+        self.lastFlushMs = (time.perf_counter() - start) * 1000
+        self.totalFlushMs += self.lastFlushMs
+        self.flushes += 1
+        return True
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "requests": self.requests,
+            "flushes": self.flushes,
+            "coalesced": self.requests - self.flushes - self.pending,
+            "lastFlushMs": self.lastFlushMs,
+            "totalFlushMs": self.totalFlushMs,
+        }
@@ -0,0 +1,121 @@
+"""
+Search query syntax.
+
+    cat "night sky" tag:wip -tag:done modified:>2026-01-01 created:<=2025-12-31
+
+Bare words and quoted phrases must all appear, case-insensitively, in a memo's
+content or hashtags. `tag:` requires an exact hashtag. `modified:` and
+`created:` compare against a date (YYYY-MM-DD, optionally with a time) using
+one of > >= < <= = (plain equality without an operator). A leading "-" negates
+any term. Date terms that don't parse yet, e.g. while being typed, are ignored.
+"""
+
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from . import codec
+
+_TERM = re.compile(r'(-)?(?:(tag|modified|created):)?(?:"([^"]*)"?|(\S+))')
+_DATE = re.compile(r"(>=|<=|>|<|=)?(.+)")
+
+DATE_FIELDS = ("created", "modified")
+
+
+class Term:
+    __slots__ = ("kind", "value", "negated", "field", "lo", "hi")
+
+    def __init__(self, kind: str, value: str, negated: bool = False,
+                 field: str = None, lo: int = None, hi: int = None):
+        # kind is "text", "tag" or "date"; text values are lowercased, and date
+        # terms cover [lo, hi) in microseconds on `field` (either end may be None)
+        self.kind = kind
+        self.value = value
+        self.negated = negated
+        self.field = field
+        self.lo = lo
+        self.hi = hi
+
+    def test(self, memo) -> bool:
+        return self._test(memo) != self.negated
+
+    def _test(self, memo) -> bool:
+        if self.kind == "text":
+            if self.value in memo.lower:
+                return True
+            return any(self.value in tag for tag in memo.tags_lower)
+        if self.kind == "tag":
+            return self.value in memo.tag_set
+        us = memo.created_us if self.field == "created" else memo.modified_us
+        return (self.lo is None or us >= self.lo) and (self.hi is None or us < self.hi)
+
+
+def _dateRange(spec: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    m = _DATE.fullmatch(spec)
+    if not m:
+        return None
+    op, value = m.groups()
+    try:
+        start = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # a bare date means the whole day, a time means that instant
+    step = timedelta(days=1) if len(value) <= 10 else timedelta(microseconds=1)
+    lo = codec.iso_to_us(start.isoformat())
+    hi = codec.iso_to_us((start + step).isoformat())
+    return {
+        ">": (hi, None),
+        ">=": (lo, None),
+        "<": (None, lo),
+        "<=": (None, hi),
+    }.get(op, (lo, hi))
+
+
+class Query:
+
+    def __init__(self, terms: List[Term], plain: bool):
+        self.terms = terms
+        # only positive words and phrases: appending to such a query can only narrow it
+        self.plain = plain
+
+    def __bool__(self):
+        return bool(self.terms)
+
+    @property
+    def words(self) -> List[str]:
+        # positive text, the part a relevance ranking scores
+        return [t.value for t in self.terms if t.kind == "text" and not t.negated]
+
+    def indexed(self) -> bool:
+        # whether some term narrows the candidates through an index
+        for t in self.terms:
+            if t.negated:
+                continue
+            if t.kind in ("tag", "date") or (t.kind == "text" and len(t.value) >= 3):
+                return True
+        return False
+
+    def matches(self, memo) -> bool:
+        return all(t.test(memo) for t in self.terms)
+
+
+def parse_query(text: str) -> Query:
+    terms = []
+    plain = True
+    for m in _TERM.finditer(text or ""):
+        negated, field, phrase, word = m.groups()
+        value = phrase if phrase is not None else word
+        negated = bool(negated)
+        if negated or field:
+            plain = False
+
+        if field == "tag":
+            if value:
+                terms.append(Term("tag", value, negated))
+        elif field in DATE_FIELDS:
+            bounds = _dateRange(value)
+            if bounds is not None:
+                terms.append(Term("date", value, negated, field, *bounds))
+        elif value:
+            terms.append(Term("text", value.lower(), negated))
+    return Query(terms, plain)
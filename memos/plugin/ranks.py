@@ -0,0 +1,79 @@
+"""
+Lexicographic ranks for the manual memo order.
+
+A rank is a string of base-62 digits read as a fraction, so comparing ranks as
+plain strings compares positions and there is always room for another rank
+between two neighbours. Ranks never end in the zero digit, which keeps room
+below every rank too. Moving a memo gives it one new rank and leaves every
+other memo untouched.
+"""
+
+from typing import List, Optional
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+# repeated inserts into one gap lengthen ranks; past this the store re-spreads them
+MAX_LEN = 24
+# appends step at this many digits: 62**4 / 2 appends before ranks grow
+APPEND_WIDTH = 4
+
+_VALUE = {c: i for i, c in enumerate(DIGITS)}
+
+
+def _midpoint(lo: str, hi: Optional[str]) -> str:
+    # a rank strictly between lo ("" for the start) and hi (None for the end)
+    if hi is not None:
+        n = 0
+        while n < len(hi) and (lo[n] if n < len(lo) else "0") == hi[n]:
+            n += 1
+        if n:
+            return hi[:n] + _midpoint(lo[n:], hi[n:])
+
+    a = _VALUE[lo[0]] if lo else 0
+    b = _VALUE[hi[0]] if hi is not None else BASE
+    if b - a > 1:
+        return DIGITS[(a + b) // 2]
+    if hi is not None and len(hi) > 1:
+        return hi[0]
+    return DIGITS[a] + _midpoint(lo[1:], None)
+
+
+def between(lo: Optional[str], hi: Optional[str]) -> str:
+    # None leaves that side open
+    if lo is not None and hi is not None and not lo < hi:
+        raise ValueError(f"rank {lo!r} is not below {hi!r}")
+    return _midpoint(lo or "", hi)
+
+
+def after(rank: Optional[str]) -> str:
+    # one step above `rank` at a fixed width, so a run of appends stays short
+    if not rank:
+        return DIGITS[BASE // 2]
+    digits = [_VALUE[c] for c in rank.ljust(APPEND_WIDTH, "0")]
+    i = len(digits) - 1
+    while i >= 0 and digits[i] == BASE - 1:
+        i -= 1
+    if i < 0:
+        return rank + DIGITS[BASE // 2]
+    digits = digits[:i + 1]
+    digits[i] += 1
+    return "".join(DIGITS[d] for d in digits)
+
+
+def spread(count: int) -> List[str]:
+    # `count` ascending ranks spaced evenly over the lower half of the range,
+    # leaving the upper half for appends
+    width = 1
+    while BASE ** width < 4 * (count + 1):
+        width += 1
+    step = BASE ** width // (2 * (count + 1))
+
+    result = []
+    for i in range(1, count + 1):
+        value = i * step
+        digits = []
+        for _ in range(width):
+            value, d = divmod(value, BASE)
+            digits.append(DIGITS[d])
+        result.append("".join(reversed(digits)).rstrip("0"))
+    return result
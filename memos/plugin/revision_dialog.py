@@ -0,0 +1,92 @@
+from PyQt5.QtWidgets import (
+    QDialog, QWidget, QVBoxLayout, QHBoxLayout, QSplitter, QListWidget, QListWidgetItem,
+    QPlainTextEdit, QLabel, QPushButton
+)
+from PyQt5.QtCore import Qt
+from datetime import datetime
+from .i18n import i18n
+
+
+class RevisionDialog(QDialog):
+    RevisionRole = Qt.UserRole
+
+    def __init__(self, store, uid, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.uid = uid
+        self.setWindowTitle(i18n("Memo History"))
+        self.resize(520, 360)
+
+        layout = QVBoxLayout()
+        splitter = QSplitter(Qt.Horizontal)
+
+        self.revisionList = QListWidget()
+        self.revisionList.currentItemChanged.connect(self.onRevisionSelected)
+        splitter.addWidget(self.revisionList)
+
+        preview = QVBoxLayout()
+        previewWidget = QWidget()
+        previewWidget.setLayout(preview)
+        self.tagsLabel = QLabel()
+        self.tagsLabel.setWordWrap(True)
+        self.previewEdit = QPlainTextEdit()
+        self.previewEdit.setReadOnly(True)
+        preview.setContentsMargins(0, 0, 0, 0)
+        preview.addWidget(self.tagsLabel)
+        preview.addWidget(self.previewEdit)
+        splitter.addWidget(previewWidget)
+        splitter.setStretchFactor(1, 1)
+        layout.addWidget(splitter)
+
+        buttons = QHBoxLayout()
+        buttons.addStretch()
+        self.restoreBtn = QPushButton(i18n("Restore"))
+        self.restoreBtn.setEnabled(False)
+        self.restoreBtn.clicked.connect(self.onRestore)
+        closeBtn = QPushButton(i18n("Close"))
+        closeBtn.clicked.connect(self.reject)
+        buttons.addWidget(self.restoreBtn)
+        buttons.addWidget(closeBtn)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.populate()
+
+    def populate(self):
+        self.revisionList.clear()
+        memo = self.store.get(self.uid)
+        if memo is None:
+            return
+
+        # newest first, starting with the memo as it is now
+        current = QListWidgetItem(f"{memo.modified_label}  ({i18n('Current')})")
+        current.setData(self.RevisionRole, -1)
+        self.revisionList.addItem(current)
+        revisions = self.store.revisions(self.uid)
+        for index in range(len(revisions) - 1, -1, -1):
+            modified, _ = revisions[index]
+            label = datetime.fromisoformat(modified).strftime("%Y/%m/%d %H:%M:%S")
+            item = QListWidgetItem(label)
+            item.setData(self.RevisionRole, index)
+            self.revisionList.addItem(item)
+        self.revisionList.setCurrentRow(0)
+
+    def selectedMemo(self):
+        item = self.revisionList.currentItem()
+        if item is None:
+            return None, -1
+        index = item.data(self.RevisionRole)
+        if index < 0:
+            return self.store.get(self.uid), index
+        return self.store.revision(self.uid, index), index
+
+    def onRevisionSelected(self, current, previous):
+        memo, index = self.selectedMemo()
+        self.previewEdit.setPlainText(memo.content if memo else "")
+        self.tagsLabel.setText(" ".join(f"#{tag}" for tag in memo.hashtags) if memo else "")
+        self.restoreBtn.setEnabled(memo is not None and index >= 0)
+
+    def onRestore(self):
+        memo, index = self.selectedMemo()
+        if memo is not None and index >= 0 and self.store.restore_revision(self.uid, index):
+            self.accept()
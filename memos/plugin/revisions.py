@@ -0,0 +1,217 @@
+"""
+Per-memo revision history.
+
+A memo's earlier versions form a chain of reverse diffs (see undo.delta): the
+newest revision is a diff from the current content and each older one a diff
+from the revision after it, so reading a revision back applies one diff per
+step down the chain. Autosaves of a memo that follow each other within
+WINDOW_S fold into its newest revision, until that revision spans MAX_SPAN_S.
+A chain keeps at most MAX_REVISIONS revisions and MAX_BYTES of diff text,
+dropping the oldest first.
+
+Chains are spread over SHARDS annotations by uid, as memos are (see
+shards.py). Each holds one zlib-compressed JSON chain per memo behind a
+directory line:
+
+    KMR1\\n
+    {"uid": [offset, length], ...}\\n
+    chain, chain, ...
+
+A chain is {"h": crc32 of the content it leads back from, "r": [revision, ...]}
+with revisions oldest first as [modified, hashtags, hunks, started]. A chain
+whose crc no longer matches its memo (changed while history was off) is
+dropped.
+
+Between compactions a change to a chain travels in the edit journal (see
+journal.py) as a record of the one revision it touched, and the shards are
+rewritten only when the store compacts:
+
+    ["r", uid, crc before, crc after, revision, replaces]
+
+`replaces` swaps out the newest revision (a coalesced autosave) instead of
+appending; a null revision with it drops the newest one.
+"""
+
+import json
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import shards, undo
+
+KEY_PREFIX = "krita_memos_revisions_"
+HEADER = b"KMR1\n"
+ENABLED = True
+SHARDS = 16
+
+WINDOW_S = 60
+MAX_SPAN_S = 15 * 60
+MAX_REVISIONS = 50
+MAX_BYTES = 64 * 1024
+
+
+def shard_key(i: int) -> str:
+    return f"{KEY_PREFIX}{i:02x}"
+
+
+def _crc(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def _size(revs: List[list]) -> int:
+    return sum(len(text) + 16 for rev in revs for _, _, text in rev[2])
+
+
+def decode(data: Optional[bytes]) -> Dict[str, bytes]:
+    # splits the annotation into compressed chains; each is inflated on first use
+    if not data:
+        return {}
+    data = bytes(data)
+    if not data.startswith(HEADER):
+        raise ValueError("not a memo revision history")
+    end = data.index(b"\n", len(HEADER))
+    directory = json.loads(data[len(HEADER):end].decode("utf-8"))
+    base = end + 1
+    return {uid: data[base + offset:base + offset + length] for uid, (offset, length) in directory.items()}
+
+
+class RevisionLog:
+
+    def __init__(self, blobs: Dict[str, bytes] = None):
+        self._blobs: Dict[str, bytes] = dict(blobs or {})
+        self._chains: Dict[str, dict] = {}
+        # when each memo was last recorded this session, for coalescing
+        self._lastAt: Dict[str, float] = {}
+        # shards with chains changed since the last compaction
+        self.dirty = set()
+        self.coalesced = 0
+
+    def _chain(self, uid: str) -> Optional[dict]:
+        chain = self._chains.get(uid)
+        if chain is None and uid in self._blobs:
+            try:
+                chain = json.loads(zlib.decompress(self._blobs[uid]).decode("utf-8"))
+            except (zlib.error, ValueError) as e:
+                print(f"[Memos] Revision history unreadable for {uid}: {e}")
+                del self._blobs[uid]
+                return None
+            self._chains[uid] = chain
+        return chain
+
+    def _valid(self, uid: str, content: str) -> Optional[dict]:
+        chain = self._chain(uid)
+        if chain is not None and chain["h"] != _crc(content):
+            self.forget(uid)
+            return None
+        return chain
+
+    def record(self, uid: str, old: str, oldTags: List[str], oldModified: str, new: str, newTags: List[str]) -> list:
+        # called before a memo's content goes from `old` to `new`; returns the
+        # journal record of the change
+        chain = self._valid(uid, old)
+        revs = chain["r"] if chain is not None else []
+        now = time.time()
+        last = self._lastAt.get(uid)
+        self._lastAt[uid] = time.monotonic()
+
+        if revs and last is not None and time.monotonic() - last < WINDOW_S and now - revs[-1][3] < MAX_SPAN_S:
+            # `old` was only an autosave in between; diff straight to the version before it
+            before, _ = undo.patch(old, revs[-1][2])
+            rev = [revs[-1][0], revs[-1][1], undo.delta(new, before), revs[-1][3]]
+            self.coalesced += 1
+            if not rev[2] and rev[1] == list(newTags):
+                # edited back to where the burst started
+                rev = None
+            record = ["r", uid, _crc(old), _crc(new), rev, True]
+        else:
+            record = ["r", uid, _crc(old), _crc(new), [oldModified, list(oldTags), undo.delta(new, old), now], False]
+        self.replay([record])
+        return record
+
+    def replay(self, records: Iterable[list]):
+        # applies "r" journal records; one whose chain has moved on is skipped,
+        # and one whose chain is missing or stale starts the chain afresh
+        for _, uid, old, new, rev, replaces in records:
+            chain = self._chain(uid)
+            if chain is not None and chain["h"] == new != old:
+                continue
+            revs = chain["r"] if chain is not None and chain["h"] == old else []
+            if replaces and revs:
+                revs.pop()
+            if rev is not None:
+                revs.append(rev)
+            while len(revs) > MAX_REVISIONS or (len(revs) > 1 and _size(revs) > MAX_BYTES):
+                revs.pop(0)
+            self._chains[uid] = {"h": new, "r": revs}
+            self._blobs.pop(uid, None)
+            self.dirty.add(shards.shard_of(uid, SHARDS))
+
+    def seal(self, uid: str):
+        # the next change to `uid` starts its own revision, however soon it comes
+        self._lastAt.pop(uid, None)
+
+    def rebase(self, uid: str, content: str):
+        # a memo (re)inserted with other content than its chain leads back from
+        self._valid(uid, content)
+
+    def forget(self, uid: str):
+        chain = self._chains.pop(uid, None)
+        blob = self._blobs.pop(uid, None)
+        if chain is not None or blob is not None:
+            self.dirty.add(shards.shard_of(uid, SHARDS))
+        self._lastAt.pop(uid, None)
+
+    def revisions(self, uid: str, content: str) -> List[Tuple[str, List[str]]]:
+        # (modified, hashtags) of each stored revision, oldest first
+        chain = self._valid(uid, content)
+        if chain is None:
+            return []
+        return [(rev[0], rev[1]) for rev in chain["r"]]
+
+    def reconstruct(self, uid: str, content: str, index: int) -> Optional[Tuple[str, List[str], str]]:
+        # (content, hashtags, modified) of revision `index`, walking back from `content`
+        chain = self._valid(uid, content)
+        if chain is None or not 0 <= index < len(chain["r"]):
+            return None
+        revs = chain["r"]
+        for rev in reversed(revs[index:]):
+            content, _ = undo.patch(content, rev[2])
+        rev = revs[index]
+        return content, list(rev[1]), rev[0]
+
+    def save(self, alive) -> Dict[str, bytes]:
+        # annotation key -> data for each dirty shard (b"" once it is empty);
+        # chains of memos not `alive` (deleted, but undoable) stay in memory only
+        dirty, self.dirty = self.dirty, set()
+        if not dirty:
+            return {}
+        members = {i: [] for i in dirty}
+        for uid in set(self._blobs) | set(self._chains):
+            i = shards.shard_of(uid, SHARDS)
+            if i in members and uid in alive:
+                members[i].append(uid)
+        return {shard_key(i): self._encode(uids) for i, uids in members.items()}
+
+    def _encode(self, uids: Iterable[str]) -> bytes:
+        directory = {}
+        parts = []
+        offset = 0
+        for uid in uids:
+            blob = self._blobs.get(uid)
+            if blob is None:
+                chain = self._chains.get(uid)
+                if not chain or not chain["r"]:
+                    continue
+                blob = zlib.compress(json.dumps(chain, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+                self._blobs[uid] = blob
+            directory[uid] = [offset, len(blob)]
+            parts.append(blob)
+            offset += len(blob)
+        if not parts:
+            return b""
+        return HEADER + json.dumps(directory, separators=(",", ":")).encode("utf-8") + b"\n" + b"".join(parts)
+
+    def stats(self) -> Dict:
+        return {"memos": len(set(self._blobs) | set(self._chains)),
+                "storedBytes": sum(len(b) for b in self._blobs.values()),
+                "coalesced": self.coalesced}
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from .query import parse_query
+
+
+class SearchPipeline(QObject):
+    # (memos in store order, or best first when ranked, query, tag)
+    resultsReady = pyqtSignal(object, str, object)
+
+    DEBOUNCE_MS = 150
+    CHUNK = 2000
+    CACHE_SIZE = 16
+    RANK_LIMIT = 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.store = None
+        self.cache = OrderedDict()
+        self.cacheVersion = None
+        self.last = None
+        self.generation = 0
+        self.pending = None
+        # rank queries by relevance instead of filtering in store order
+        self.ranked = False
+        # let query words match a few typos away
+        self.fuzzy = False
+        self.hits = 0
+        self.misses = 0
+
+        self.debounceTimer = QTimer(self)
+        self.debounceTimer.setSingleShot(True)
+        self.debounceTimer.timeout.connect(self._onDebounce)
+
+    def setStore(self, store):
+        self.cancel()
+        self.store = store
+        self.cache.clear()
+        self.last = None
+
+    def setRanked(self, ranked):
+        self.cancel()
+        self.ranked = ranked
+
+    def setFuzzy(self, fuzzy):
+        self.cancel()
+        self.fuzzy = fuzzy
+
+    def isRanked(self, query):
+        return self.mode(query) == "ranked"
+
+    def mode(self, query):
+        # None for plain filtering, which rows can be checked against one by one
+        q = parse_query(query)
+        if self.ranked and q.words:
+            return "ranked"
+        if self.fuzzy and q.words:
+            return "fuzzy"
+        return None
+
+    def request(self, query, tag):
+        self.pending = (query, tag)
+        self.debounceTimer.start(self.DEBOUNCE_MS)
+
+    def runNow(self, query, tag):
+        self.debounceTimer.stop()
+        self.pending = None
+        self._start(query, tag)
+
+    def cancel(self):
+        self.debounceTimer.stop()
+        self.pending = None
+        self.generation += 1
+
+    def _onDebounce(self):
+        if self.pending is not None:
+            query, tag = self.pending
+            self.pending = None
+            self._start(query, tag)
+
+    def _validate(self):
+        # any store mutation invalidates every cached result
+        if self.cacheVersion != self.store.version:
+            self.cache.clear()
+            self.last = None
+            self.cacheVersion = self.store.version
+
+    def _start(self, query, tag):
+        self.generation += 1
+        if self.store is None:
+            return
+
+        self._validate()
+        key = (query, tag, self.mode(query))
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            self._finish(key, cached)
+            return
+        self.misses += 1
+
+        # while an index is still being built, both fall back to exact matches
+        # found by the scan below
+        if key[2] == "ranked" and self.store.index_ready("terms"):
+            # top-k comes straight off the term index, nothing to slice
+            self._finish(key, self.store.rank(query, tag, self.RANK_LIMIT))
+            return
+        if key[2] == "fuzzy" and self.store.index_ready("text"):
+            # typo matches of a longer query aren't a subset of a shorter one's
+            self._finish(key, self.store.search(query, tag, fuzzy=True))
+            return
+
+        q = parse_query(query)
+        if self.last is not None and key[2] is None:
+            lastQuery, lastTag, lastResult = self.last
+            narrower = lastTag == tag and lastQuery and query.startswith(lastQuery)
+            if narrower and q.plain and parse_query(lastQuery).plain:
+                # more words, or longer ones, can only match a subset of the previous results
+                self._filter(key, q, lastResult, self.generation)
+                return
+
+        if not q or (q.indexed() and (not q.words or self.store.index_ready("text"))):
+            self._finish(key, self.store.search(query, tag))
+            return
+
+        # nothing here narrows through an index, so scan in slices instead of blocking
+        candidates = self.store.filter_by_hashtag(tag) if tag else self.store.memos
+        self._filter(key, q, candidates, self.generation)
+
+    def _filter(self, key, q, candidates, generation, start=0, matched=None):
+        if generation != self.generation:
+            return
+        if self.store.version != self.cacheVersion:
+            # the store changed between slices, start over on fresh data
+            self._start(key[0], key[1])
+            return
+
+        matched = matched if matched is not None else []
+        end = min(start + self.CHUNK, len(candidates))
+        for memo in candidates[start:end]:
+            if q.matches(memo):
+                matched.append(memo)
+
+        if end < len(candidates):
+            QTimer.singleShot(0, lambda: self._filter(key, q, candidates, generation, end, matched))
+            return
+        self._finish(key, matched)
+
+    def _finish(self, key, memos):
+        self.cache[key] = memos
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+        query, tag, mode = key
+        if mode is None:
+            self.last = (query, tag, memos)
+        self.resultsReady.emit(memos[:], query, tag)
@@ -0,0 +1,57 @@
+"""
+Sharded annotation layout.
+
+A small JSON manifest names the shard count; every memo lives in the shard
+picked by a hash of its uid, so an edit only rewrites that shard. Documents
+without a manifest are read from the original single annotation.
+"""
+
+import json
+import zlib
+from typing import List, Optional, Tuple
+
+MANIFEST_KEY = "krita_memos_manifest"
+SHARD_PREFIX = "krita_memos_shard_"
+SHARDS = 16
+LAYOUT = 1
+
+
+def shard_of(uid: str, count: int) -> int:
+    return zlib.crc32(uid.encode("utf-8")) % count
+
+
+def shard_key(i: int) -> str:
+    return f"{SHARD_PREFIX}{i:02x}"
+
+
+def encode_manifest(count: int) -> bytes:
+    return json.dumps({"layout": LAYOUT, "shards": count}).encode("utf-8")
+
+
+def decode_manifest(data: bytes) -> int:
+    manifest = json.loads(bytes(data).decode("utf-8"))
+    if manifest.get("layout") != LAYOUT:
+        raise ValueError(f"unsupported memo shard layout {manifest.get('layout')}")
+    return int(manifest["shards"])
+
+
+def read(doc, legacyKey: str) -> Tuple[Optional[int], List[bytes]]:
+    # (shard count or None for the single-key layout, raw blobs); GUI thread only
+    data = doc.annotation(MANIFEST_KEY)
+    if data:
+        count = decode_manifest(data)
+        blobs = []
+        for i in range(count):
+            blob = doc.annotation(shard_key(i))
+            blobs.append(bytes(blob) if blob else b"")
+        return count, blobs
+
+    data = doc.annotation(legacyKey)
+    return None, [bytes(data) if data else b""]
+
+
+def remove(doc, key: str):
+    if hasattr(doc, "removeAnnotation"):
+        doc.removeAnnotation(key)
+    else:
+        doc.setAnnotation(key, "", b"")
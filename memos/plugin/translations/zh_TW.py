@@ -16,5 +16,23 @@ translations = {
     "Confirm": "確認",
     "Delete this memo?": "確定要刪除這個備忘錄？",
     "Type tag and press Enter": "輸入標籤後按 Enter",
-    "Undo Delete": "復原刪除",
+    "Undo": "復原",
+    "Redo": "重做",
+    "History...": "歷史版本...",
+    "Memo History": "備忘錄歷史版本",
+    "Current": "目前",
+    "Restore": "還原",
+    "Loading...": "載入中...",
+    "Rename Tag...": "重新命名標籤...",
+    "Rename Tag": "重新命名標籤",
+    "New name (an existing tag merges):": "新名稱（與既有標籤相同時會合併）：",
+    "Sort results by relevance": "依相關性排序搜尋結果",
+    "Tolerate typos": "容許錯字",
+    "Manual": "手動",
+    "Modified": "修改時間",
+    "Created": "建立時間",
+    "A-Z": "字母順序",
+    "Sort order": "排序方式",
+    'Words and "phrases" must all match. Also: tag:name -tag:name modified:>2026-01-01 created:<=2026-01-31':
+        '所有字詞與 "片語" 都須符合。另可使用：tag:名稱 -tag:名稱 modified:>2026-01-01 created:<=2026-01-31',
 }
@@ -0,0 +1,217 @@
+"""
+Bounded undo/redo history for a MemoStore.
+
+Every mutation records the op that reverts it, and a step is the ops of one
+user action (a batch records one step). Reverting a step yields the ops that
+redo it, and redoing yields the undo ops again, so each side only holds what
+its direction needs: undoing an add keeps just the uid, and only undoing it
+keeps the memo around for a redo.
+
+    ("delete", uid)                                      revert an add
+    ("insert", uid, rank, content, hashtags, created, modified)
+    ("patch", uid, hunks, hashtags, modified)            revert an update
+    ("rank", uid, rank)                                  revert a move
+    ("ranks", {uid: rank})                               revert a reorder
+
+Text edits are kept as hunks (see delta) rather than whole contents. Old steps
+are evicted once the history passes MAX_STEPS or MAX_BYTES; the newest step is
+always kept, so the last action can be undone however large it was.
+"""
+
+import time
+from collections import deque
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple
+
+MAX_STEPS = 200
+# rough size of the text and keys held by both stacks
+MAX_BYTES = 4 * 1024 * 1024
+# successive edits of one memo this close together undo as one step
+MERGE_MS = 2000
+# middles longer than this are stored whole instead of being diffed
+DIFF_LIMIT = 20000
+# accounted per op on top of its strings
+_OP_BYTES = 64
+
+Hunk = Tuple[int, int, str]
+
+
+def delta(new: str, old: str) -> List[Hunk]:
+    # hunks (start, end, text) that turn `new` back into `old`: new[start:end]
+    # is replaced by text, with positions ascending in `new`
+    n = min(len(new), len(old))
+    start = 0
+    while start < n and new[start] == old[start]:
+        start += 1
+    end = 0
+    while end < n - start and new[-1 - end] == old[-1 - end]:
+        end += 1
+    a = new[start:len(new) - end]
+    b = old[start:len(old) - end]
+    if not a and not b:
+        return []
+    if not a or not b or len(a) + len(b) > DIFF_LIMIT:
+        return [(start, start + len(a), b)]
+
+    hunks = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag != "equal":
+            hunks.append((start + i1, start + i2, b[j1:j2]))
+    return hunks
+
+
+def patch(text: str, hunks: List[Hunk]) -> Tuple[str, List[Hunk]]:
+    # applies `hunks` to `text`; returns the result and the hunks undoing it
+    parts = []
+    inverse = []
+    pos = 0
+    shift = 0
+    for start, end, replacement in hunks:
+        parts.append(text[pos:start])
+        at = start + shift
+        inverse.append((at, at + len(replacement), text[start:end]))
+        parts.append(replacement)
+        shift += len(replacement) - (end - start)
+        pos = end
+    parts.append(text[pos:])
+    return "".join(parts), inverse
+
+
+def cost(op: tuple) -> int:
+    size = _OP_BYTES
+    for field in op:
+        if isinstance(field, str):
+            size += len(field)
+        elif isinstance(field, dict):
+            size += sum(len(k) + len(v) + _OP_BYTES for k, v in field.items())
+        elif isinstance(field, list):
+            for item in field:
+                if isinstance(item, str):
+                    size += len(item)
+                elif isinstance(item, tuple):
+                    size += len(item[2]) + _OP_BYTES
+    return size
+
+
+class UndoStack:
+
+    def __init__(self, maxSteps: int = None, maxBytes: int = None):
+        self.maxSteps = maxSteps if maxSteps is not None else MAX_STEPS
+        self.maxBytes = maxBytes if maxBytes is not None else MAX_BYTES
+        # (ops, bytes) per step, oldest first
+        self._undo = deque()
+        self._redo = []
+        self._bytes = 0
+        # ops of the batch being recorded, None outside one
+        self._open: Optional[list] = None
+        # merge key and time of the newest step, while it can still absorb an edit
+        self._mergeKey = None
+        self._mergeAt = 0.0
+        self.evicted = 0
+
+    def clear(self):
+        self._undo.clear()
+        self._redo = []
+        self._bytes = 0
+        self._mergeKey = None
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def stats(self):
+        return {"undo": len(self._undo), "redo": len(self._redo),
+                "bytes": self._bytes, "evicted": self.evicted}
+
+    def begin(self):
+        if self._open is None:
+            self._open = []
+
+    def end(self):
+        ops, self._open = self._open, None
+        if ops:
+            self._push(ops)
+            self._mergeKey = None
+
+    def mark(self) -> int:
+        # position in the open batch that abort() can return to
+        return len(self._open)
+
+    def abort(self, mark: int = 0) -> list:
+        # takes back the ops recorded in the open batch since `mark`
+        ops = self._open[mark:]
+        del self._open[mark:]
+        return ops
+
+    def seal(self):
+        # the next record starts its own step even if it could merge
+        self._mergeKey = None
+
+    def record(self, op: tuple, key=None):
+        # `key` lets the next record(key=...) within MERGE_MS replace this step
+        if self._open is not None:
+            self._open.append(op)
+            return
+        self._push([op])
+        self._mergeKey = key
+        self._mergeAt = time.monotonic()
+
+    def mergeable(self, key) -> Optional[tuple]:
+        # the lone op of the newest step if it was recorded under `key` recently
+        if key is None or self._open is not None or key != self._mergeKey:
+            return None
+        if (time.monotonic() - self._mergeAt) * 1000 > MERGE_MS:
+            return None
+        return self._undo[-1][0][0]
+
+    def replace(self, op: tuple):
+        # swaps the newest step's op for `op`, after mergeable() returned it
+        _, size = self._undo.pop()
+        self._bytes -= size
+        self._undo.append(([op], cost(op)))
+        self._bytes += cost(op)
+        self._mergeAt = time.monotonic()
+        self._evict()
+
+    def _push(self, ops: list):
+        for _, size in self._redo:
+            self._bytes -= size
+        self._redo = []
+        size = sum(cost(op) for op in ops)
+        self._undo.append((ops, size))
+        self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        while len(self._undo) > 1 and (len(self._undo) > self.maxSteps or self._bytes > self.maxBytes):
+            _, size = self._undo.popleft()
+            self._bytes -= size
+            self.evicted += 1
+
+    def pop_undo(self) -> Optional[list]:
+        return self._pop(self._undo)
+
+    def pop_redo(self) -> Optional[list]:
+        return self._pop(self._redo)
+
+    def _pop(self, stack) -> Optional[list]:
+        self._mergeKey = None
+        if not stack:
+            return None
+        ops, size = stack.pop()
+        self._bytes -= size
+        return ops
+
+    def push_undo(self, ops: list):
+        # ops that undo a redone step; the redo stack is left alone
+        size = sum(cost(op) for op in ops)
+        self._undo.append((ops, size))
+        self._bytes += size
+        self._evict()
+
+    def push_redo(self, ops: list):
+        size = sum(cost(op) for op in ops)
+        self._redo.append((ops, size))
+        self._bytes += size
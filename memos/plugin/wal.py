@@ -0,0 +1,129 @@
+"""
+Sidecar write-ahead log.
+
+Annotations only reach the disk when the user saves the .kra, so every memo
+change is also appended to a small file next to Krita's own data, keyed by the
+document path. It holds journal records (see journal.py) made since the last
+document save: it is trimmed on `imageSaved`, removed on `imageClosed` unless
+changes were still waiting to reach the annotations, and replayed over them
+when a document is reopened after a crash.
+"""
+
+import hashlib
+import os
+import time
+from typing import List, Optional
+
+from PyQt5.QtCore import QObject, QTimer
+
+from . import journal
+
+HEADER = b"KMW1\n"
+ENABLED = True
+# records are written and fsync'd together, at most this often
+SYNC_MS = 1000
+
+
+def directory() -> str:
+    from PyQt5.QtCore import QStandardPaths
+    return os.path.join(QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "memos_wal")
+
+
+def path_for(fileName: str) -> Optional[str]:
+    # unsaved documents have no path to key a log by
+    if not fileName:
+        return None
+    digest = hashlib.sha1(os.path.abspath(fileName).encode("utf-8")).hexdigest()
+    return os.path.join(directory(), digest[:24] + ".wal")
+
+
+def read(path: Optional[str]) -> List[list]:
+    if not path:
+        return []
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        return journal.decode(data, HEADER)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        # a log torn inside its header has nothing worth replaying
+        print(f"[Memos] Sidecar log unreadable: {e}")
+        return []
+
+
+def remove(path: Optional[str]):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SidecarLog(QObject):
+
+    def __init__(self, path: str, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.buffer = []
+        self.lastSync = 0.0
+        self.syncs = 0
+
+        self.syncTimer = QTimer(self)
+        self.syncTimer.setSingleShot(True)
+        self.syncTimer.timeout.connect(self.sync)
+
+    @classmethod
+    def open(cls, fileName: str) -> Optional['SidecarLog']:
+        path = path_for(fileName) if ENABLED else None
+        return cls(path) if path else None
+
+    def append(self, record: list):
+        self.buffer.append(record)
+        if not self.syncTimer.isActive():
+            elapsedMs = (time.monotonic() - self.lastSync) * 1000
+            self.syncTimer.start(int(max(0, SYNC_MS - elapsedMs)))
+
+    def sync(self):
+        self.syncTimer.stop()
+        if not self.buffer:
+            return
+        data = journal.encode(self.buffer)
+        self.buffer = []
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(HEADER)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.syncs += 1
+        except OSError as e:
+            print(f"[Memos] Sidecar log error: {e}")
+        self.lastSync = time.monotonic()
+
+    def reset(self, records: List[list]):
+        # replaces the log with `records`, the changes the saved file still lacks
+        self.syncTimer.stop()
+        self.buffer = []
+        if not records:
+            remove(self.path)
+            return
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(HEADER + journal.encode(records))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[Memos] Sidecar log error: {e}")
+        self.lastSync = time.monotonic()
+
+    def discard(self):
+        self.syncTimer.stop()
+        self.buffer = []
+        remove(self.path)
@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# the plugin is imported as the `plugin` package, as Krita's loader does from
+# memos/; going through memos/__init__.py would try to register the extension
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "memos"))
+
+# `krita` only exists inside Krita; the modules tested here import it but
+# never call into it
+if "krita" not in sys.modules:
+    krita = types.ModuleType("krita")
+    krita.Krita = krita.DockWidget = krita.Extension = None
+    sys.modules["krita"] = krita
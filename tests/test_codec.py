@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from plugin import codec, ranks
+
+MEMOS = [
+    {"uid": "a1", "content": "first memo", "hashtags": ["wip", "sketch"],
+     "created": "2025-01-02T03:04:05.123456", "modified": "2025-02-03T04:05:06"},
+    {"uid": "b2", "content": "", "hashtags": [],
+     "created": "2024-12-31T23:59:59", "modified": "2024-12-31T23:59:59"},
+    {"uid": "c3", "content": "線稿\n上色 ✏️ emoji", "hashtags": ["上色", "wip"],
+     "created": "1969-07-20T20:17:40", "modified": "2026-10-17T00:00:00.000001"},
+]
+
+
+def _rows(records):
+    return [{"uid": records.uids[i], "content": records.content(i), "hashtags": records.hashtags(i),
+             "created": records.created(i), "modified": records.modified(i)}
+            for i in range(len(records))]
+
+
+@pytest.mark.parametrize("threshold", [None, 0])
+def test_v2_round_trip(threshold):
+    rankList = ranks.spread(len(MEMOS))
+    data = codec.encode(MEMOS, threshold, ranks=rankList)
+    assert codec.detect_version(data) == codec.VERSION
+    version, records = codec.decode(data)
+    assert version == codec.VERSION
+    assert _rows(records) == MEMOS
+    assert records.order == rankList
+    assert [records.content_length(i) for i in range(len(records))] == [len(m["content"]) for m in MEMOS]
+    assert records.created_us(0) == codec.iso_to_us(MEMOS[0]["created"])
+
+
+def test_v2_round_trip_without_ranks():
+    version, records = codec.decode(codec.encode(MEMOS))
+    assert _rows(records) == MEMOS and records.order is None
+
+
+def test_empty_round_trip():
+    version, records = codec.decode(codec.encode([]))
+    assert len(records) == 0
+
+
+def test_v1_json():
+    data = json.dumps({"version": 1, "memos": MEMOS}).encode("utf-8")
+    version, records = codec.decode(data)
+    assert version == 1
+    assert _rows(records) == MEMOS
+    assert records.content_length(2) == len(MEMOS[2]["content"])
+
+
+def test_timestamps_round_trip():
+    for iso in ("2025-01-02T03:04:05.123456", "1969-07-20T20:17:40", "2000-02-29T00:00:00"):
+        assert codec.us_to_iso(codec.iso_to_us(iso)) == iso
@@ -0,0 +1,92 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from plugin.indexes import bounded_levenshtein
+from plugin.memo import Memo, MemoStore
+from plugin.query import parse_query
+
+WORDS = "sketch color light shadow anatomy pose brush layer night sky 線稿 上色".split()
+TAGS = ["wip", "done", "ref", "上色"]
+
+QUERIES = [
+    "", "sketch", "SKETCH", "sk", "ske", "sketch color", "\"night sky\"", "\"sky night\"",
+    "-sketch", "sketch -color", "wip", "tag:wip", "-tag:wip", "tag:wip -tag:done", "tag:上色", "線稿",
+    "created:2025-03-01", "created:>2025-03-01", "created:>=2025-03-01", "created:<2025-03-01",
+    "created:<=2025-03-01T12:00:00", "modified:>=2025-06-01", "-modified:>=2025-06-01",
+    "created:>=2025-02-01 modified:<2025-07-01", "created:<2025-01-15 modified:<2025-09-01",
+    "modified:<2025-07-01 created:>=2025-02-01 sketch",
+    "created:>=2025-02-01 created:<2025-04-01 tag:ref",
+    "created:2025-13", "brush tag:wip modified:>2025-05-01 -light",
+]
+
+
+@pytest.fixture(scope="module")
+def store():
+    rng = random.Random(3)
+    base = datetime(2025, 1, 1)
+    memos = []
+    for i in range(600):
+        created = base + timedelta(hours=rng.randrange(24 * 180))
+        modified = created + timedelta(hours=rng.randrange(24 * 90))
+        content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        memos.append(Memo(content, rng.sample(TAGS, rng.randint(0, 2)), f"m{i:04d}",
+                          created.isoformat(), modified.isoformat()))
+    store = MemoStore()
+    store.memos = memos
+    return store
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("hashtag", [None, "wip"])
+def test_select_matches_every_term(store, query, hashtag):
+    q = parse_query(query)
+    expected = [m for m in store.memos if q.matches(m) and (hashtag is None or hashtag in m.hashtags)]
+    assert [m.uid for m in store.search(query, hashtag)] == [m.uid for m in expected]
+
+
+def test_select_after_edits(store):
+    memo = store.memos[10]
+    store.update(memo.uid, "sketch of a night sky", ["wip"])
+    store.delete(store.memos[20].uid)
+    store.add(Memo("brush layer", ["ref"], "extra", "2025-03-01T12:00:00", "2025-08-01T00:00:00"))
+    for query in QUERIES:
+        q = parse_query(query)
+        assert store.select(q) == {m.uid for m in store.memos if q.matches(m)}, query
+
+
+def test_fuzzy_finds_exact_matches_too(store):
+    q = parse_query("sketch")
+    assert {m.uid for m in store.search("sketch", fuzzy=True)} >= {m.uid for m in store.memos if q.matches(m)}
+    assert store.search("sketck", fuzzy=True)
+
+
+@pytest.mark.parametrize("typo", ["skecth", "ksetch", "skethc"])
+def test_fuzzy_counts_a_swap_as_one_edit(store, typo):
+    q = parse_query("sketch")
+    assert {m.uid for m in store.search(typo, fuzzy=True)} >= {m.uid for m in store.memos if q.matches(m)}
+    assert bounded_levenshtein(typo, "sketch", 1) == 1
+
+
+def test_select_before_the_text_index_is_built():
+    calls = []
+
+    class Builder:
+        def buildIndex(self, store, name):
+            calls.append((name,) + store.index_snapshot(name))
+
+    store = MemoStore()
+    store.memos = [Memo(f"sketch {i}", ["wip"] if i % 2 else []) for i in range(50)]
+    store.builder = Builder()
+    q = parse_query("sketch tag:wip")
+    expected = {m.uid for m in store.memos if q.matches(m)}
+    # matched memo by memo until the index is in, then through it
+    assert store.select(q) == expected and not store.index_ready("text")
+    store.update(store.memos[1].uid, "redrawn", ["wip"])
+    name, token, snapshot = calls[0]
+    assert store.install_index(name, store.build_index(name, snapshot), token)
+    assert store.index_ready("text")
+    assert store.select(q) == expected - {store.memos[1].uid}
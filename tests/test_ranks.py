@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from plugin import ranks
+
+
+def test_between_is_strictly_between():
+    rng = random.Random(1)
+    order = ranks.spread(8)
+    for _ in range(500):
+        i = rng.randrange(len(order) + 1)
+        lo = order[i - 1] if i else None
+        hi = order[i] if i < len(order) else None
+        rank = ranks.between(lo, hi)
+        assert (lo is None or lo < rank) and (hi is None or rank < hi)
+        assert not rank.endswith(ranks.DIGITS[0])
+        order.insert(i, rank)
+    assert order == sorted(order)
+
+
+def test_between_keeps_room_in_one_gap():
+    lo, hi = ranks.spread(2)
+    for _ in range(200):
+        hi = ranks.between(lo, hi)
+        assert lo < hi
+
+
+def test_between_rejects_unordered_bounds():
+    with pytest.raises(ValueError):
+        ranks.between("V", "V")
+    with pytest.raises(ValueError):
+        ranks.between("W", "V")
+
+
+def test_after_ascends_at_fixed_width():
+    rank = None
+    seen = []
+    for _ in range(1000):
+        rank = ranks.after(rank)
+        seen.append(rank)
+    assert seen == sorted(seen) and len(set(seen)) == len(seen)
+    assert max(len(r) for r in seen) <= ranks.APPEND_WIDTH
+
+
+def test_after_past_the_last_digit():
+    top = ranks.DIGITS[-1] * ranks.APPEND_WIDTH
+    assert ranks.after(top) > top
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 61, 62, 1000, 5000])
+def test_spread(count):
+    spread = ranks.spread(count)
+    assert len(spread) == count
+    assert spread == sorted(spread) and len(set(spread)) == count
+    assert all(not r.endswith(ranks.DIGITS[0]) for r in spread)
+    if spread:
+        # appends go above the spread ranks
+        assert ranks.after(spread[-1]) > spread[-1]
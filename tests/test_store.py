@@ -0,0 +1,250 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from plugin import journal, revisions, shards, wal
+from plugin.memo import Memo, MemoStore
+
+
+class Doc:
+    # the slice of a Krita document the store reads and writes
+
+    def __init__(self, fileName=""):
+        self.ann = {}
+        self.written = []
+        self._fileName = fileName
+
+    def annotation(self, key):
+        return self.ann.get(key, b"")
+
+    def setAnnotation(self, key, description, data):
+        self.ann[key] = bytes(data)
+        self.written.append(key)
+
+    def removeAnnotation(self, key):
+        self.ann.pop(key, None)
+
+    def annotationTypes(self):
+        return list(self.ann)
+
+    def fileName(self):
+        return self._fileName
+
+
+def _store(count=6):
+    store = MemoStore()
+    store.memos = [Memo(f"memo {i} sketch", ["wip"] if i % 2 else [], f"m{i}") for i in range(count)]
+    return store
+
+
+def _state(store):
+    return [(m.to_dict(), store.order_key(m.uid)) for m in store.memos]
+
+
+def _reload(doc):
+    store = MemoStore()
+    store.set_document(doc)
+    return store
+
+
+def _history(store):
+    return {m.uid: [store.revision(m.uid, i).content for i in range(len(store.revisions(m.uid)))]
+            for m in store.memos}
+
+
+def test_batch_rolls_back_on_error():
+    store = _store()
+    before = _state(store)
+    events = []
+
+    def observer(event, uid):
+        events.append(event)
+    store.subscribe(observer)
+
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.add(Memo("added", [], "new"))
+            store.update("m1", "memo 1 changed", ["done"])
+            store.delete("m2")
+            store.move("m4", above="m0")
+            store.reorder(["m5", "m3"])
+            raise RuntimeError("boom")
+
+    assert _state(store) == before
+    assert events == []
+    assert not store.can_undo()
+    assert [m.uid for m in store.search("changed")] == []
+    assert [m.uid for m in store.search("sketch")] == [m.uid for m in store.memos]
+
+
+def test_nested_batch_error_keeps_outer_changes():
+    store = _store()
+    with store.batch():
+        store.update("m0", "memo 0 kept", [])
+        try:
+            with store.batch():
+                store.delete("m1")
+                raise ValueError
+        except ValueError:
+            pass
+    assert store.get("m0").content == "memo 0 kept"
+    assert store.get("m1") is not None
+    assert store.undo()
+    assert store.get("m0").content == "memo 0 sketch"
+    assert not store.can_undo()
+
+
+def test_revisions_travel_in_the_journal_until_compaction(monkeypatch):
+    doc = Doc()
+    store = _reload(doc)
+    store.add_many(Memo(f"memo {i}", [], f"m{i}") for i in range(40))
+    monkeypatch.setattr(revisions, "WINDOW_S", 0)
+    for n in range(3):
+        store.update("m1", f"m1 v{n}", [])
+    monkeypatch.setattr(revisions, "WINDOW_S", 60)
+    # an autosave burst folds into one revision, or none once edited back
+    store.update("m3", "memo 3 x", [])
+    store.update("m3", "memo 3 xy", [])
+    store.update("m4", "a", [])
+    store.update("m4", "memo 4", [])
+    doc.written.clear()
+    store.flush()
+    assert doc.written == [journal.KEY]
+
+    expected = _history(store)
+    assert expected["m1"] == ["memo 1", "m1 v0", "m1 v1"]
+    assert expected["m3"] == ["memo 3"] and expected["m4"] == []
+    assert _history(_reload(doc)) == expected
+
+    store.compact()
+    assert journal.KEY not in doc.ann
+    assert any(key.startswith(revisions.KEY_PREFIX) for key in doc.ann)
+    assert _history(_reload(doc)) == expected
+
+
+def test_single_key_document_moves_to_shards():
+    doc = Doc()
+    legacy = [Memo(f"memo {i}", ["wip"], f"m{i}").to_dict() for i in range(30)]
+    doc.ann[MemoStore.ANNOTATION_KEY] = json.dumps({"version": 1, "memos": legacy}).encode("utf-8")
+    store = _reload(doc)
+    assert store.shardCount is None and [m.to_dict() for m in store.memos] == legacy
+
+    store.update("m3", "changed", [])
+    store.flush()
+    assert MemoStore.ANNOTATION_KEY not in doc.ann and shards.MANIFEST_KEY in doc.ann
+    assert _state(_reload(doc)) == _state(store)
+
+    # after the move a compaction rewrites only the shards that changed
+    store.update("m7", "changed too", ["done"])
+    store.flush()
+    doc.written.clear()
+    store.compact()
+    written = [key for key in doc.written if key.startswith(shards.SHARD_PREFIX)]
+    assert written == [shards.shard_key(shards.shard_of("m7", store.shardCount))]
+    assert _state(_reload(doc)) == _state(store)
+
+
+def test_journal_replays_over_the_shards():
+    doc = Doc()
+    store = _reload(doc)
+    store.add_many(Memo(f"memo {i}", [], f"m{i}") for i in range(30))
+    shardData = {k: v for k, v in doc.ann.items() if k.startswith(shards.SHARD_PREFIX)}
+
+    store.add(Memo("added", ["new"], "a"))
+    store.update("m2", "m2 edited", ["wip"])
+    store.delete("m5")
+    store.move("m9", above="m0")
+    store.flush()
+    assert journal.KEY in doc.ann
+    assert {k: v for k, v in doc.ann.items() if k.startswith(shards.SHARD_PREFIX)} == shardData
+    assert _state(_reload(doc)) == _state(store)
+
+    store.reorder(["m20", "m4"])
+    store.flush()
+    assert _state(_reload(doc)) == _state(store)
+
+    store.compact()
+    assert journal.KEY not in doc.ann
+    assert _state(_reload(doc)) == _state(store)
+
+
+def test_journal_torn_tail_keeps_the_records_before_it():
+    doc = Doc()
+    store = _reload(doc)
+    store.add_many(Memo(f"memo {i}", [], f"m{i}") for i in range(10))
+    store.update("m1", "kept", [])
+    store.flush()
+    doc.ann[journal.KEY] += b'["u","m2","lo'
+
+    reloaded = _reload(doc)
+    assert _state(reloaded) == _state(store)
+    reloaded.update("m3", "after", [])
+    reloaded.compact()
+    assert _state(_reload(doc)) == _state(reloaded)
+
+
+@pytest.fixture
+def walDir(tmp_path, monkeypatch):
+    path = str(tmp_path / "wal")
+    monkeypatch.setattr(wal, "directory", lambda: path)
+    return path
+
+
+def test_sidecar_log_recovers_unsaved_changes(tmp_path, walDir):
+    fileName = str(tmp_path / "a.kra")
+    doc = Doc(fileName)
+    store = _reload(doc)
+    store.add_many(Memo(f"memo {i}", [], f"m{i}") for i in range(10))
+    store.flush()
+    saved = dict(doc.ann)
+    store.document_saved()
+    assert not os.path.exists(wal.path_for(fileName))
+
+    store.update("m1", "edited", ["wip"])
+    store.add(Memo("added", [], "a"))
+    store.delete("m4")
+    store.wal.sync()
+
+    # a crash: the annotations fall back to the saved file, the log survives
+    crashed = Doc(fileName)
+    crashed.ann = dict(saved)
+    recovered = _reload(crashed)
+    assert _state(recovered) == _state(store)
+    recovered.compact()
+    recovered.document_saved()
+    assert not os.path.exists(wal.path_for(fileName))
+    again = Doc(fileName)
+    again.ann = dict(crashed.ann)
+    assert _state(_reload(again)) == _state(store)
+
+
+def test_sidecar_log_is_trimmed_on_save_and_close(tmp_path, walDir):
+    fileName = str(tmp_path / "a.kra")
+    doc = Doc(fileName)
+    store = _reload(doc)
+    store.add(Memo("first", [], "m1"))
+    store.flush()
+    store.document_saved()
+    store.add(Memo("second", [], "m2"))
+    store.wal.sync()
+    path = wal.path_for(fileName)
+    assert [rec[0] for rec in wal.read(path)] == ["a"]
+
+    # a save keeps only what has not reached the annotations yet
+    store.add(Memo("third", [], "m3"))
+    store.document_saved()
+    assert [rec[1] for rec in wal.read(path)] == ["m2", "m3"]
+    store.flush()
+    store.document_saved()
+    assert not os.path.exists(path)
+
+    # a close with nothing pending drops the log, a pending write keeps it
+    store.add(Memo("late", [], "m4"))
+    assert store.document_closed() and [rec[1] for rec in wal.read(path)] == ["m4"]
+    reopened = _reload(Doc(fileName))
+    assert [m.uid for m in reopened.memos] == ["m4"]
+    reopened.flush()
+    assert not reopened.document_closed() and not os.path.exists(path)
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from plugin import undo
+
+
+def _mutate(rng, text):
+    alphabet = "ab c\n上色"
+    chars = list(text)
+    for _ in range(rng.randint(0, 6)):
+        op = rng.randrange(3)
+        i = rng.randint(0, len(chars))
+        if op == 0 or not chars:
+            chars[i:i] = rng.choices(alphabet, k=rng.randint(1, 5))
+        elif op == 1:
+            del chars[i:i + rng.randint(1, 5)]
+        else:
+            chars[i:i + 1] = rng.choice(alphabet)
+    return "".join(chars)
+
+
+@pytest.mark.parametrize("new, old", [
+    ("", ""),
+    ("abc", "abc"),
+    ("", "abc"),
+    ("abc", ""),
+    ("hello world", "hello there world"),
+    ("線稿 上色", "線稿 陰影 上色"),
+])
+def test_patch_reverts_delta(new, old):
+    hunks = undo.delta(new, old)
+    result, inverse = undo.patch(new, hunks)
+    assert result == old
+    assert undo.patch(result, inverse)[0] == new
+    if new == old:
+        assert hunks == []
+
+
+def test_patch_reverts_delta_randomly():
+    rng = random.Random(7)
+    for _ in range(500):
+        old = "".join(rng.choices("ab c\n上色", k=rng.randint(0, 40)))
+        new = _mutate(rng, old)
+        hunks = undo.delta(new, old)
+        result, inverse = undo.patch(new, hunks)
+        assert result == old
+        assert undo.patch(old, inverse)[0] == new
+
+
+def test_long_middles_are_stored_whole():
+    old = "x" + "a" * undo.DIFF_LIMIT + "x"
+    new = "x" + "b" * undo.DIFF_LIMIT + "x"
+    hunks = undo.delta(new, old)
+    assert hunks == [(1, 1 + undo.DIFF_LIMIT, "a" * undo.DIFF_LIMIT)]
+    assert undo.patch(new, hunks)[0] == old
+
+
+def test_stack_keeps_newest_step_over_budget():
+    stack = undo.UndoStack(maxSteps=3, maxBytes=200)
+    for i in range(5):
+        stack.record(("delete", f"uid{i}"))
+    assert stack.stats()["undo"] == 2
+    stack.record(("insert", "big", "V", "x" * 1000, [], "", ""))
+    assert stack.stats()["undo"] == 1
+    assert stack.pop_undo()[0][1] == "big"
+    assert not stack.can_undo()